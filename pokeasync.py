@@ -0,0 +1,146 @@
+'''Asyncio runtime for the bot. One event loop long-polls the updates, runs a
+task per update and the periodic jobs; the blocking pokedb work goes through
+AsyncDB, a bounded executor with one thread per pooled connection, so any
+number of chats waiting on the database only hold a coroutine each.'''
+from pokedb import DB
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+logger = logging.getLogger('poke.telegram.async')
+
+
+class AsyncDB(object):
+    '''Runs blocking calls on at most `workers` threads. The thread's connection
+    goes back to the pool after every call.'''
+    def __init__(self, workers=4):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                thread_name_prefix='db')
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(
+            self._call, fn, args, kwargs))
+
+    @staticmethod
+    def _call(fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncRuntime(object):
+    '''Dispatches the updates of bot to handlers with the signatures of the
+    threaded Dispatcher ones, (bot, update) or (bot, update, args) for commands
+    with pass_args. Updates of the same chat are handled in order, different
+    chats concurrently. Handlers get handler_bot (the Sender, so no DB thread
+    waits on Telegram) and run on db.'''
+
+    def __init__(self, bot, db, handler_bot=None, error=None, poll_timeout=10):
+        self.bot = bot
+        self.db = db
+        self.handler_bot = handler_bot or bot
+        self.error = error
+        self.poll_timeout = poll_timeout
+        self.commands = {} # name -> (fn, pass_args)
+        self.location = None
+        self.text = None
+        self.jobs = [] # (TickScheduler, fn, delay)
+        self.chats = {} # chat_id -> [asyncio.Lock, updates waiting or running]
+        self.tasks = set()
+        self.stopping = False
+
+    def command(self, name, fn, pass_args=False):
+        self.commands[name] = (fn, pass_args)
+
+    def on_location(self, fn):
+        self.location = fn
+
+    def on_text(self, fn):
+        self.text = fn
+
+    def every(self, scheduler, fn, delay=0.0):
+        '''Runs fn(handler_bot, None) on the ticks of scheduler, as a task of the loop'''
+        self.jobs.append((scheduler, fn, delay))
+
+    def route(self, message):
+        '''(handler, extra args) for a message, None if nothing handles it'''
+        text = message.text or ''
+        if text.startswith('/'):
+            parts = text[1:].split()
+            name = parts[0].split('@')[0] if parts else ''
+            if name not in self.commands:
+                return None
+            fn, pass_args = self.commands[name]
+            return (fn, (parts[1:],) if pass_args else ())
+        if getattr(message, 'location', None) is not None and self.location:
+            return (self.location, ())
+        if text and self.text:
+            return (self.text, ())
+        return None
+
+    async def handle(self, update):
+        message = update.message
+        route = self.route(message)
+        if route is None:
+            return
+        fn, args = route
+        chat = self.chats.setdefault(message.chat_id, [asyncio.Lock(), 0])
+        chat[1] += 1
+        try:
+            async with chat[0]:
+                await self.db.run(fn, self.handler_bot, update, *args)
+        except Exception as e:
+            if self.error:
+                self.error(self.handler_bot, update, e)
+            else:
+                logger.error('Update "{}" caused error "{}"'.format(update, e))
+        finally:
+            chat[1] -= 1
+            if chat[1] == 0:
+                del self.chats[message.chat_id]
+
+    def dispatch(self, update):
+        if getattr(update, 'message', None) is None:
+            return
+        task = asyncio.ensure_future(self.handle(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        offset = None
+        while not self.stopping:
+            try:
+                # getUpdates blocks for up to poll_timeout, on the default executor
+                updates = await loop.run_in_executor(None, functools.partial(
+                    self.bot.getUpdates, offset=offset, timeout=self.poll_timeout))
+            except Exception as e:
+                logger.warning("Error getting updates - {}".format(e))
+                await asyncio.sleep(1.0)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update)
+
+    async def run_job(self, scheduler, fn, delay):
+        await scheduler.run_async(lambda: self.db.run(fn, self.handler_bot, None), delay)
+
+    async def run(self):
+        jobs = [ asyncio.ensure_future(self.run_job(s, fn, delay)) for s, fn, delay in self.jobs ]
+        try:
+            await self.poll()
+        finally:
+            for s, fn, delay in self.jobs:
+                s.stopping.set()
+            for task in jobs:
+                task.cancel()
+            await asyncio.gather(*(jobs + list(self.tasks)), return_exceptions=True)
+
+    def stop(self):
+        self.stopping = True
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''Benchmarks for the alert pipeline.
+
+  queries  counts the queries one periodic check issues against the database in
+           poke.json. Synthetic users are added with ids from BENCH_USER_ID up
+           and removed at the end. --shards runs the matcher in that many
+           processes.
+  tick     seeds users, filters, positions and spawns around a city, then runs
+           the periodic check with a fake bot, adding spawns and moving some
+           users before each tick. Reports tick latency, queries, memory and
+           notifications per second; --save writes them as JSON for a later
+           --compare. Runs on a new SQLite database, in a temporary file or in
+           --sqlite FILE; --use-configured-db runs it on the database in
+           poke.json instead, where a running bot would alert about the fake
+           spawns.
+  records  compares time and memory of building spawns as Data objects and as
+           SpawnRecord tuples, from synthetic rows (no database needed).
+  distance checks pokematch.distances() and distance_matrix() against the
+           per-pair distance() on random points and compares their speed.'''
+from pokedb import *
+import pokematch
+from pokeshard import ShardedMatcher
+import argparse
+import random
+import time
+import tracemalloc
+import collections
+import gc
+import json
+import resource
+import tempfile
+import shutil
+import sys
+import os
+
+BENCH_USER_ID = 1 << 30
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendVenue(self, chat_id, latitude, longitude, title, address, **kwargs):
+        self.sent.append((chat_id, latitude, longitude, title, address))
+
+    def sendMessage(self, chat_id, text=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def seed_users(first, count, lat, lng, spread, filters):
+    '''Adds users BENCH_USER_ID + first on, each somewhere around (lat, lng) and
+    following filters random pokemons, with a few bulk statements'''
+    ids = [ BENCH_USER_ID + i for i in range(first, first + count) ]
+    if not User.save_many([ User(id=uid, first_name='bench', last_name=str(uid - BENCH_USER_ID),
+            username='bench{}'.format(uid - BENCH_USER_ID), chat_id=str(uid), distance=1000)
+            for uid in ids ]):
+        raise RuntimeError("could not seed the users")
+    move_users(ids, lat, lng, spread)
+    rows = [ (uid, pokemon_id) for uid in ids for pokemon_id in random.sample(range(1, 152), filters) ]
+    with DB.transaction():
+        c = DB.cursor()
+        for i in range(0, len(rows), 5000):
+            c.executemany('INSERT INTO user_filters VALUES ( %s , %s )', rows[i:i+5000])
+    return ids
+
+
+def move_users(ids, lat, lng, spread):
+    now = time.time()
+    if not UserPosition.save_many([ UserPosition(user_id=uid, timestamp=now,
+            latitude=lat + random.uniform(-spread, spread),
+            longitude=lng + random.uniform(-spread, spread)) for uid in ids ]):
+        raise RuntimeError("could not move the users")
+
+
+def seed_spawns(first, count, lat, lng, spread):
+    '''Adds count spawns of random pokemons around (lat, lng), expiring in 5 to 30 minutes'''
+    names = [ p.internal_name for p in Pokemon.all() ]
+    now = int(time.time())
+    Spawn.register_many([ { 'encounter_id': 'bench-{}'.format(i),
+        'expiration_timestamp': now + random.randint(300, 1800),
+        'latitude': lat + random.uniform(-spread, spread),
+        'longitude': lng + random.uniform(-spread, spread),
+        'name': random.choice(names), 'spawn_point_id': 'bench' } for i in range(first, first + count) ])
+
+
+def drop_bench_data():
+    c = DB.cursor()
+    c.execute('DELETE FROM user_filters WHERE user_id >= %s', (BENCH_USER_ID,))
+    c.execute('DELETE FROM user_positions WHERE user_id >= %s', (BENCH_USER_ID,))
+    c.execute('DELETE FROM user_current_position WHERE user_id >= %s', (BENCH_USER_ID,))
+    c.execute('DELETE FROM notifications WHERE user_id >= %s', (BENCH_USER_ID,))
+    c.execute('DELETE FROM users WHERE id >= %s', (BENCH_USER_ID,))
+    c.execute("DELETE FROM spawns WHERE encounter_id LIKE 'bench-%'")
+    DB.commit()
+    User.cache.clear()
+    for uid in [uid for uid in UserPosition.cache if uid >= BENCH_USER_ID]:
+        del UserPosition.cache[uid]
+
+
+def count_queries(fn, *args):
+    before = DB.queries
+    start = time.time()
+    result = fn(*args)
+    return result, DB.queries - before, time.time() - start
+
+
+def bench_queries(args):
+    import telegrambot # needs python-telegram-bot, only this benchmark drives the bot
+
+    if args.shards > 1:
+        telegrambot.matcher = ShardedMatcher(args.shards)
+    random.seed(0)
+    seeded = 0
+    try:
+        for total in sorted(args.users):
+            seed_users(seeded, total - seeded, args.lat, args.lng, args.spread, args.filters)
+            seeded = total
+
+            _, loader, _ = count_queries(User.snapshot)
+            bot = FakeBot()
+            _, tick, elapsed = count_queries(telegrambot.callback_periodic_check, bot, None)
+            print("users={:6d} snapshot_queries={:3d} tick_queries={:6d} sent={:5d} tick={:.3f}s".format(
+                total, loader, tick, len(bot.sent), elapsed))
+    finally:
+        drop_bench_data()
+        if args.shards > 1:
+            telegrambot.matcher.stop()
+
+
+def use_sqlite(path):
+    '''Runs on a new SQLite database at path instead of the one in poke.json'''
+    from pokedb_data import insert_pokemon
+    try:
+        config = load_config()
+    except IOError:
+        config = config_cache['poke.json'] = {}
+    config['database'] = { 'driver': 'sqlite', 'file': path }
+    DB(wipe=True)
+    insert_pokemon()
+
+
+def summarize(ticks):
+    seconds = sorted(t['seconds'] for t in ticks)
+    warm = sorted(t['seconds'] for t in ticks[1:]) or seconds
+    total = sum(seconds)
+    sent = sum(t['sent'] for t in ticks)
+    return collections.OrderedDict([
+        ('first_tick', ticks[0]['seconds']),
+        ('warm_median', warm[len(warm) // 2]),
+        ('tick_max', seconds[-1]),
+        ('queries_per_tick', sum(t['queries'] for t in ticks) / float(len(ticks))),
+        ('sent', sent),
+        ('sent_per_second', sent / total if total else 0.0),
+        ('maxrss_kib', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+    ])
+
+
+def compare(summary, filename):
+    with open(filename) as f:
+        before = json.load(f)['summary']
+    print("compared with {}:".format(filename))
+    for k, v in summary.items():
+        if k not in before:
+            continue
+        change = (v - before[k]) / float(before[k]) * 100.0 if before[k] else 0.0
+        print("  {:18s} {:>12.4g} -> {:<12.4g} {:+.1f}%".format(k, before[k], v, change))
+
+
+def bench_tick(args):
+    tmpdir = None
+    if not args.use_configured_db:
+        if not args.sqlite:
+            tmpdir = tempfile.mkdtemp(prefix='pokebench-')
+        use_sqlite(args.sqlite or os.path.join(tmpdir, 'bench.db'))
+    import telegrambot # needs python-telegram-bot, only this benchmark drives the bot
+
+    if args.shards > 1:
+        telegrambot.matcher = ShardedMatcher(args.shards)
+    random.seed(args.seed)
+    try:
+        start = time.perf_counter()
+        ids = seed_users(0, args.users, args.lat, args.lng, args.spread, args.filters)
+        seed_spawns(0, args.spawns, args.lat, args.lng, args.spread)
+        next_spawn = args.spawns
+        print("seeded users={} filters={} spawns={} in {:.1f}s".format(
+            args.users, args.filters, args.spawns, time.perf_counter() - start))
+
+        if args.trace_memory:
+            tracemalloc.start()
+        bot = FakeBot()
+        ticks = []
+        for i in range(args.ticks):
+            if i > 0:
+                seed_spawns(next_spawn, args.new_spawns, args.lat, args.lng, args.spread)
+                next_spawn += args.new_spawns
+                move_users(random.sample(ids, int(len(ids) * args.moving)),
+                        args.lat, args.lng, args.spread)
+            sent = len(bot.sent)
+            _, queries, elapsed = count_queries(telegrambot.callback_periodic_check, bot, None)
+            ticks.append({ 'seconds': elapsed, 'queries': queries, 'sent': len(bot.sent) - sent })
+            print("tick={:3d} time={:.3f}s queries={:4d} sent={:6d}".format(
+                i, elapsed, queries, ticks[-1]['sent']))
+
+        summary = summarize(ticks)
+        if args.trace_memory:
+            summary['traced_peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.stop()
+        stages = telegrambot.stats.jobs['periodic'].stages
+        for k, v in summary.items():
+            print("{:18s} {:.4g}".format(k, v))
+        print("stages " + ' '.join('{}={:.3f}s'.format(k, v) for k, v in stages.items()))
+        if args.compare:
+            compare(summary, args.compare)
+        if args.save:
+            run = { k: v for k, v in vars(args).items() if k != 'run' }
+            with open(args.save, 'w') as f:
+                json.dump({ 'args': run, 'backend': DB.backend.name,
+                    'numpy': pokematch.numpy is not None, 'python': sys.version.split()[0],
+                    'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'summary': summary,
+                    'stages': stages, 'ticks': ticks }, f, indent=2)
+            print("saved to {}".format(args.save))
+    finally:
+        drop_bench_data()
+        if args.shards > 1:
+            telegrambot.matcher.stop()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def measure(build, rows):
+    '''(seconds, bytes) to build the objects for rows, holding all of them'''
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    objs = build(rows)
+    elapsed = time.perf_counter() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    return elapsed, size
+
+
+def bench_records(args):
+    random.seed(0)
+    columns = Spawn._attrs()
+    tuples = [ (i, 'enc{}'.format(i), 1500000000 + i, -30.0 + random.random(),
+            -51.0 + random.random(), 'PIDGEY', 'sp{}'.format(i)) for i in range(args.spawns) ]
+    dicts = [ dict(zip(columns, row)) for row in tuples ]
+
+    for label, build, rows in (
+            ('Data objects', lambda rows: [Spawn(**row) for row in rows], dicts),
+            ('SpawnRecord', lambda rows: list(map(SpawnRecord._make, rows)), tuples)):
+        elapsed, size = measure(build, rows)
+        print("{:12s} spawns={:7d} build={:.3f}s memory={:7.1f}KiB ({:.0f} bytes/spawn)".format(
+            label, len(rows), elapsed, size / 1024.0, size / float(len(rows))))
+
+
+def bench_distance(args):
+    random.seed(0)
+    Point = collections.namedtuple('Point', ['latitude', 'longitude'])
+    spawns = [ Point(args.lat + random.uniform(-args.spread, args.spread),
+            args.lng + random.uniform(-args.spread, args.spread)) for i in range(args.spawns) ]
+    users = spawns[:args.users]
+    lats = [s.latitude for s in spawns]
+    lngs = [s.longitude for s in spawns]
+
+    start = time.perf_counter()
+    expected = [ [pokematch.distance(s, u) for s in spawns] for u in users ]
+    pair_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    each = [ pokematch.distances(u, lats, lngs) for u in users ]
+    each_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = pokematch.distance_matrix(users, lats, lngs)
+    matrix_time = time.perf_counter() - start
+
+    worst = 0.0
+    for want, got_each, got_matrix in zip(expected, each, matrix):
+        for w, a, b in zip(want, got_each, got_matrix):
+            worst = max(worst, abs(w - a) / max(w, 1.0), abs(w - b) / max(w, 1.0))
+
+    print("numpy={} users={} spawns={} per-pair={:.3f}s distances={:.3f}s matrix={:.3f}s".format(
+        pokematch.numpy is not None, len(users), len(spawns), pair_time, each_time, matrix_time))
+    print("max relative error {:.3g} ({})".format(worst, "ok" if worst < 1e-9 else "MISMATCH"))
+    return worst < 1e-9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+
+    queries = commands.add_parser('queries')
+    queries.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000])
+    queries.add_argument('--filters', type=int, default=10)
+    queries.add_argument('--lat', type=float, default=-30.03)
+    queries.add_argument('--lng', type=float, default=-51.22)
+    queries.add_argument('--spread', type=float, default=0.1)
+    queries.add_argument('--shards', type=int, default=1)
+    queries.set_defaults(run=bench_queries)
+
+    tick = commands.add_parser('tick')
+    tick.add_argument('--users', type=int, default=1000)
+    tick.add_argument('--filters', type=int, default=10)
+    tick.add_argument('--spawns', type=int, default=5000)
+    tick.add_argument('--new-spawns', type=int, default=200, help='inserted before each tick')
+    tick.add_argument('--moving', type=float, default=0.05,
+            help='fraction of the users sending a new position before each tick')
+    tick.add_argument('--ticks', type=int, default=10)
+    tick.add_argument('--lat', type=float, default=-30.03)
+    tick.add_argument('--lng', type=float, default=-51.22)
+    tick.add_argument('--spread', type=float, default=0.1)
+    tick.add_argument('--shards', type=int, default=1)
+    tick.add_argument('--seed', type=int, default=0)
+    where = tick.add_mutually_exclusive_group()
+    where.add_argument('--sqlite', metavar='FILE', help='run on a new SQLite database in FILE')
+    where.add_argument('--use-configured-db', action='store_true',
+            help='seed and run on the database in poke.json')
+    tick.add_argument('--trace-memory', action='store_true',
+            help='also report the traced Python heap peak (slows the ticks down)')
+    tick.add_argument('--save', metavar='FILE', help='write the results as JSON')
+    tick.add_argument('--compare', metavar='FILE', help='compare with results saved before')
+    tick.set_defaults(run=bench_tick)
+
+    records = commands.add_parser('records')
+    records.add_argument('--spawns', type=int, default=50000)
+    records.set_defaults(run=bench_records)
+
+    distance = commands.add_parser('distance')
+    distance.add_argument('--users', type=int, default=100)
+    distance.add_argument('--spawns', type=int, default=20000)
+    distance.add_argument('--lat', type=float, default=-30.03)
+    distance.add_argument('--lng', type=float, default=-51.22)
+    distance.add_argument('--spread', type=float, default=0.1)
+    distance.set_defaults(run=bench_distance)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+    # a run returns False when a check failed
+    sys.exit(0 if args.run(args) is not False else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,357 @@
 import threading
 import sqlite3
-import mysql.connector
 import logging
 import collections
+import contextlib
+import functools
 import time
 import json
+import re
 
 DB_threadlocal = threading.local()
 
+# (version, statements), applied in order to bring an older database up to date.
+# statements is a list, or a dict of lists by driver when they differ
+MIGRATIONS = [
+    (20161002, [
+        '''CREATE TABLE `users` (
+            `id` INTEGER NOT NULL UNIQUE PRIMARY KEY,
+            `first_name` VARCHAR(256),
+            `last_name` VARCHAR(256),
+            `username` VARCHAR(256),
+            `chat_id` VARCHAR(256) NOT NULL UNIQUE,
+            `distance` INTEGER) ''',
+
+        '''CREATE TABLE `user_positions` (
+            `user_id` INTEGER,
+            `timestamp` INTEGER,
+            `latitude` REAL,
+            `longitude` REAL )''',
+
+        '''CREATE TABLE `location_groups` (
+            `id` INTEGER NOT NULL UNIQUE PRIMARY KEY AUTO_INCREMENT,
+            `name` VARCHAR(256) )''',
+
+        '''CREATE TABLE `locations` (
+            `id` INTEGER NOT NULL UNIQUE PRIMARY KEY AUTO_INCREMENT,
+            `location_group_id` INTEGER NOT NULL,
+            `name` VARCHAR(256),
+            `latitude` REAL,
+            `longitude` REAL )''',
+
+        '''CREATE TABLE `pokemons` (
+            `id` INTEGER NOT NULL UNIQUE PRIMARY KEY,
+            `name` VARCHAR(64),
+            `internal_name` VARCHAR(64),
+            `rarity` INTEGER )''',
+
+        '''CREATE TABLE `user_filters` (
+            `user_id` INTEGER,
+            `pokemon_id` INTEGER,
+            PRIMARY KEY( `user_id`, `pokemon_id` ) )''',
+
+        '''CREATE TABLE `spawns` (
+            `encounter_id` VARCHAR(64) UNIQUE,
+            `expiration_timestamp` INTEGER,
+            `latitude` REAL,
+            `longitude` REAL,
+            `name` VARCHAR(64),
+            `spawn_point_id` VARCHAR(256) )''',
+
+        '''CREATE TABLE `notifications` (
+            `encounter_id` VARCHAR(64),
+            `user_id` INTEGER,
+            PRIMARY KEY( `encounter_id`, `user_id`) )''',
+
+        '''CREATE TABLE `version` (
+            `version` INTEGER UNSIGNED NOT NULL )''' ]),
+
+    # insertion order of the spawns, used as cursor by the incremental polling
+    (20261018, {
+        'mysql': [
+            '''ALTER TABLE `spawns`
+                ADD `id` INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY''' ],
+        # sqlite can't add a primary key to an existing table
+        'sqlite': [
+            '''CREATE TABLE `spawns_new` (
+                `id` INTEGER NOT NULL PRIMARY KEY AUTO_INCREMENT,
+                `encounter_id` VARCHAR(64) UNIQUE,
+                `expiration_timestamp` INTEGER,
+                `latitude` REAL,
+                `longitude` REAL,
+                `name` VARCHAR(64),
+                `spawn_point_id` VARCHAR(256) )''',
+            '''INSERT INTO `spawns_new` (encounter_id, expiration_timestamp, latitude,
+                    longitude, name, spawn_point_id)
+                SELECT encounter_id, expiration_timestamp, latitude, longitude, name,
+                    spawn_point_id FROM `spawns` ORDER BY expiration_timestamp''',
+            '''DROP TABLE `spawns`''',
+            '''ALTER TABLE `spawns_new` RENAME TO `spawns`''' ] }),
+
+    # indexes for the queries run every tick and on every message
+    (20261019, [
+        '''CREATE INDEX `spawns_expiration` ON `spawns` (`expiration_timestamp`)''',
+        '''CREATE INDEX `user_positions_last` ON `user_positions` (`user_id`, `timestamp`)''',
+        '''CREATE INDEX `pokemons_name` ON `pokemons` (`name`)''',
+        '''CREATE INDEX `pokemons_internal_name` ON `pokemons` (`internal_name`)''',
+        '''CREATE INDEX `locations_group` ON `locations` (`location_group_id`)''' ]),
+
+    # last position of each user, user_positions becomes an optional history
+    (20261020, [
+        '''CREATE TABLE `user_current_position` (
+            `user_id` INTEGER NOT NULL PRIMARY KEY,
+            `timestamp` INTEGER,
+            `latitude` REAL,
+            `longitude` REAL )''',
+
+        '''INSERT IGNORE INTO `user_current_position` (user_id, timestamp, latitude, longitude)
+            SELECT p.user_id, p.timestamp, p.latitude, p.longitude FROM user_positions AS p
+            JOIN (SELECT user_id, MAX(timestamp) AS timestamp
+                    FROM user_positions GROUP BY user_id) AS l
+                ON l.user_id = p.user_id AND l.timestamp = p.timestamp''',
+
+        '''CREATE INDEX `user_positions_timestamp` ON `user_positions` (`timestamp`)''' ]),
+]
+
+
+class MySQLBackend(object):
+    name = 'mysql'
+
+    def connect(self, db):
+        import mysql.connector
+        return mysql.connector.connect(user=db["user"], password=db["password"],
+                host=db["host"], database=db["database"])
+
+    def cursor(self, conn, tuples=False):
+        # buffered, so a cursor can be reused before all its rows were read
+        return conn.cursor(dictionary=not tuples, buffered=True)
+
+    def sql(self, statement):
+        return statement
+
+    def ping(self, conn):
+        try:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+            return True
+        except Exception as e:
+            logging.warn("DB connection failed health check - {}".format(e))
+            return False
+
+    def is_disconnect(self, e):
+        # server has gone away, lost connection during query, lost connection
+        return getattr(e, 'errno', None) in (2006, 2013, 2055)
+
+
+class SQLiteBackend(object):
+    '''Runs the same statements on sqlite (3.35 or newer), translating the MySQL
+    syntax used in this module. Translations are cached, so sqlite's own statement
+    cache reuses the prepared statements.'''
+    name = 'sqlite'
+
+    translations = [
+        (re.compile(r'%\((\w+)\)s'), r':\1'),
+        (re.compile(r'%s'), '?'),
+        (re.compile(r'UNIX_TIMESTAMP\(\s*NOW\(\)\s*\)'), "CAST(strftime('%s', 'now') AS INTEGER)"),
+        (re.compile(r'INSERT IGNORE'), 'INSERT OR IGNORE'),
+        (re.compile(r'ON DUPLICATE KEY UPDATE'), 'ON CONFLICT DO UPDATE SET'),
+        (re.compile(r'PRIMARY KEY AUTO_INCREMENT'), 'PRIMARY KEY AUTOINCREMENT'),
+        # DELETE ... LIMIT is not compiled in by default
+        (re.compile(r'^\s*DELETE FROM (\S+) WHERE (.*) LIMIT (\S+)\s*$', re.S),
+            r'DELETE FROM \1 WHERE rowid IN (SELECT rowid FROM \1 WHERE \2 LIMIT \3)'),
+    ]
+
+    def connect(self, db):
+        # connections move between threads through the pool, one thread at a time
+        conn = sqlite3.connect(db.get("file", "poke.db"), timeout=db.get("timeout", 30),
+                cached_statements=256, check_same_thread=False)
+        conn.row_factory = lambda cursor, row: { col[0]: row[i]
+                for i, col in enumerate(cursor.description) }
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def cursor(self, conn, tuples=False):
+        c = conn.cursor()
+        if tuples:
+            c.row_factory = None
+        return c
+
+    def ping(self, conn):
+        return True
+
+    def is_disconnect(self, e):
+        return False
+
+    @functools.lru_cache(maxsize=512)
+    def sql(self, statement):
+        for pattern, repl in self.translations:
+            statement = pattern.sub(repl, statement)
+        return statement
+
+
+BACKENDS = {
+    'mysql': MySQLBackend(),
+    'sqlite': SQLiteBackend(),
+}
+
+
+config_lock = threading.Lock()
+config_cache = {}
+
+def load_config(filename='poke.json'):
+    '''The configuration file, read once per process'''
+    with config_lock:
+        if filename not in config_cache:
+            with open(filename) as config_file:
+                config_cache[filename] = json.load(config_file)
+        return config_cache[filename]
+
+
+class ConnectionPool(object):
+    '''Process-wide pool of connections, each lent to one thread at a time.
+    Connections idle for more than check_after seconds are checked (and
+    reconnected) before being lent again.'''
+    def __init__(self, backend, db, size=8, timeout=30, check_after=30):
+        self.backend = backend
+        self.db = db
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.idle = [] # (conn, last used)
+        self.created = 0
+        self.cond = threading.Condition()
+
+    def get(self):
+        with self.cond:
+            while not self.idle and self.created >= self.size:
+                if not self.cond.wait(self.timeout):
+                    raise RuntimeError("No free DB connection after {}s (pool-size={})".format(
+                        self.timeout, self.size))
+            if self.idle:
+                conn, last = self.idle.pop()
+            else:
+                conn, last = None, None
+                self.created += 1
+
+        if conn is not None and (time.time() - last < self.check_after or self.backend.ping(conn)):
+            return conn
+        if conn is not None:
+            self.discard(conn)
+            with self.cond:
+                self.created += 1
+        try:
+            return self.backend.connect(self.db)
+        except Exception:
+            with self.cond:
+                self.created -= 1
+                self.cond.notify()
+            raise
+
+    def put(self, conn):
+        with self.cond:
+            self.idle.append((conn, time.time()))
+            self.cond.notify()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.created -= 1
+            self.cond.notify()
+
+
 class DB(object):
+    '''Per-thread handle on the pool. A thread borrows a connection on its first
+    query and keeps it, with one reusable cursor, until DB.release()'''
+    queries = 0
+    query_time = 0.0 # seconds spent in queries
+    queries_lock = threading.Lock()
+    setup_lock = threading.Lock()
+    pool = None
+    backend = None
+    version = 0
+
     def __new__(cls, **kwargs):
-        if getattr(DB_threadlocal, 'db_instance', None) is None:
-            config = {}
-            with open('poke.json') as config_file:
-                config = json.load(config_file)
+        if cls.pool is None or kwargs.get('wipe'):
+            cls.setup(drop_before=kwargs.get('wipe'))
+        return cls.local()
 
-            db = config["database"]
-                
+    @classmethod
+    def local(cls):
+        if getattr(DB_threadlocal, 'db_instance', None) is None:
             DB_threadlocal.db_instance = object.__new__(cls)
-            DB_threadlocal.db_instance.conn = mysql.connector.connect(user=db["user"],
-                    password=db["password"], host=db["host"], database=db["database"])
-            DB_threadlocal.db_instance.cursor_param = {"dictionary": True}
-            DB_threadlocal.db_instance.__createTables(drop_before=kwargs.get('wipe'))
-
+            DB_threadlocal.db_instance.conn = None
+            DB_threadlocal.db_instance.cursors = {} # reusable Cursor by kind, dict or tuple rows
+            DB_threadlocal.db_instance.pending = False # statements since the last commit
+            DB_threadlocal.db_instance.dirty = False # writes since the last commit
+            DB_threadlocal.db_instance.depth = 0 # nested DB.transaction() blocks
+            DB_threadlocal.db_instance.aborted = False # rolled back inside a transaction
+            DB_threadlocal.db_instance.queries = 0 # queries and their seconds in this thread
+            DB_threadlocal.db_instance.query_time = 0.0
         return DB_threadlocal.db_instance
-        
+
+    @classmethod
+    def setup(cls, **kwargs):
+        '''Creates the pool and brings the schema up to date, once per process'''
+        with cls.setup_lock:
+            if cls.pool is not None and not kwargs.get('drop_before'):
+                return
+            db = load_config()["database"]
+            backend = BACKENDS[db.get("driver", "mysql")]
+            pool = cls.pool or ConnectionPool(backend, db, size=db.get("pool-size", 8),
+                    timeout=db.get("pool-timeout", 30), check_after=db.get("pool-check-after", 30))
+
+            local = cls.local()
+            local._release()
+            cls.backend = backend
+            local.conn = pool.get()
+            try:
+                local.__createTables(**kwargs)
+                cls.version = local.version
+            finally:
+                pool.put(local.conn)
+                local.conn = None
+                local.cursors = {}
+            cls.pool = pool
+
+    def _acquire(self):
+        if self.conn is None:
+            self.conn = DB.pool.get()
+            self.cursors = {}
+        return self.conn
+
+    def _cursor(self, tuples=False):
+        self._acquire()
+        if tuples not in self.cursors:
+            self.cursors[tuples] = Cursor(self, tuples)
+        return self.cursors[tuples]
+
+    def _reconnect(self):
+        DB.pool.discard(self.conn)
+        self.conn = None
+        self.pending = self.dirty = False
+        return self._acquire()
+
+    def _release(self):
+        if self.conn is None:
+            return
+        conn = self.conn
+        self.conn = None
+        self.cursors = {}
+        try:
+            if self.pending:
+                conn.rollback() # ends the snapshot of reads, if any
+            DB.pool.put(conn)
+        except Exception as e:
+            logging.warn("Dropping DB connection on release - {}".format(e))
+            DB.pool.discard(conn)
+        self.pending = self.dirty = False
+
     def __createTables(self, **kwargs):
         drop_before = kwargs.get('drop_before')
-        cursor = self.cursor()
+        cursor = self._cursor()
         try:
             cursor.execute('SELECT `version` FROM `version` ORDER BY `version` DESC LIMIT 1')
             v = cursor.fetchone()
@@ -41,6 +365,7 @@ class DB(object):
                 logging.warning('Dropping the existing database')
                 cursor.execute('DROP TABLE IF EXISTS `users`')
                 cursor.execute('DROP TABLE IF EXISTS `user_positions`')
+                cursor.execute('DROP TABLE IF EXISTS `user_current_position`')
                 cursor.execute('DROP TABLE IF EXISTS `location_groups`')
                 cursor.execute('DROP TABLE IF EXISTS `locations`')
                 cursor.execute('DROP TABLE IF EXISTS `pokemons`')
@@ -52,65 +377,18 @@ class DB(object):
                 self.conn.commit()
 
 
-            current_version = 20161002
-            if self.version < current_version:
-                cursor.execute('''CREATE TABLE `users` (
-                    `id` INTEGER NOT NULL UNIQUE PRIMARY KEY,
-                    `first_name` VARCHAR(256),
-                    `last_name` VARCHAR(256),
-                    `username` VARCHAR(256),
-                    `chat_id` VARCHAR(256) NOT NULL UNIQUE,
-                    `distance` INTEGER) ''')
-
-                cursor.execute('''CREATE TABLE `user_positions` (
-                    `user_id` INTEGER,
-                    `timestamp` INTEGER,
-                    `latitude` REAL,
-                    `longitude` REAL )''')
-
-                cursor.execute('''CREATE TABLE `location_groups` (
-                    `id` INTEGER NOT NULL UNIQUE PRIMARY KEY AUTO_INCREMENT,
-                    `name` VARCHAR(256) )''')
-
-                cursor.execute('''CREATE TABLE `locations` (
-                    `id` INTEGER NOT NULL UNIQUE PRIMARY KEY AUTO_INCREMENT,
-                    `location_group_id` INTEGER NOT NULL,
-                    `name` VARCHAR(256),
-                    `latitude` REAL,
-                    `longitude` REAL )''')
-
-                cursor.execute('''CREATE TABLE `pokemons` (
-                    `id` INTEGER NOT NULL UNIQUE PRIMARY KEY,
-                    `name` VARCHAR(64),
-                    `internal_name` VARCHAR(64),
-                    `rarity` INTEGER )''')
-
-                cursor.execute('''CREATE TABLE `user_filters` (
-                    `user_id` INTEGER,
-                    `pokemon_id` INTEGER,
-                    PRIMARY KEY( `user_id`, `pokemon_id` ) )''')
-
-                cursor.execute('''CREATE TABLE `spawns` (
-                    `encounter_id` VARCHAR(64) UNIQUE,
-                    `expiration_timestamp` INTEGER,
-                    `latitude` REAL,
-                    `longitude` REAL,
-                    `name` VARCHAR(64),
-                    `spawn_point_id` VARCHAR(256) )''')
-
-                cursor.execute('''CREATE TABLE `notifications` (
-                    `encounter_id` VARCHAR(64),
-                    `user_id` INTEGER,
-                    PRIMARY KEY( `encounter_id`, `user_id`) )''')
-
-                cursor.execute('''CREATE TABLE `version` (
-                    `version` INTEGER UNSIGNED NOT NULL )''')
-
-                cursor.execute('''INSERT INTO `version` (`version`) values ( %s )''', (current_version,) )
+            for version, statements in MIGRATIONS:
+                if version <= self.version:
+                    continue
+                if isinstance(statements, dict):
+                    statements = statements[self.backend.name]
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute('''INSERT INTO `version` (`version`) values ( %s )''', (version,) )
 
                 self.conn.commit()
-                self.version = current_version
-                logging.debug("Upgraded DB to version {}".format(current_version) )
+                self.version = version
+                logging.debug("Upgraded DB to version {}".format(self.version) )
         except Exception as e:
             self.conn.rollback()
             logging.error("Error creating DB: ({}) - {}".format(kwargs, e))
@@ -118,34 +396,193 @@ class DB(object):
 
     @classmethod
     def connection(cls):
-        return cls().conn
+        return cls()._acquire()
+
+    @classmethod
+    def config(cls):
+        return load_config()
 
     @classmethod
-    def cursor(cls):
-        return cls().conn.cursor( **cls().cursor_param )
+    def cursor(cls, tuples=False):
+        '''Cursor returning rows as dicts, or as plain tuples for the bulk queries
+        that build records'''
+        return cls()._cursor(tuples)
+
+    @classmethod
+    def release(cls):
+        '''Gives this thread's connection back to the pool'''
+        cls.local()._release()
+
+    @classmethod
+    def count_query(cls, n=1, seconds=0.0):
+        with cls.queries_lock:
+            cls.queries += n
+            cls.query_time += seconds
+        local = cls.local()
+        local.queries += n
+        local.query_time += seconds
+
+    @classmethod
+    def thread_queries(cls):
+        '''(queries, seconds) run by this thread so far'''
+        local = cls.local()
+        return local.queries, local.query_time
 
     @classmethod
     def commit(cls):
-        return cls().conn.commit()
+        db = cls()
+        if db.depth > 0:
+            return # done when the transaction block ends
+        if db.conn is not None:
+            db.conn.commit()
+        db.pending = db.dirty = False
 
     @classmethod
     def rollback(cls):
-        return cls().conn.rollback()
+        db = cls()
+        if db.depth > 0:
+            db.aborted = True
+        if db.conn is not None:
+            db.conn.rollback()
+        db.pending = db.dirty = False
+
+    @classmethod
+    def in_transaction(cls):
+        return cls().depth > 0
+
+    @classmethod
+    @contextlib.contextmanager
+    def transaction(cls):
+        '''Runs the block as one transaction: the commits inside it are deferred to a
+        single one at the end, and an error or a rollback anywhere in it undoes the
+        whole block. Blocks can be nested, only the outermost commits.'''
+        db = cls()
+        db.depth += 1
+        try:
+            yield db
+        except:
+            db.depth -= 1
+            if db.depth == 0:
+                db.aborted = False
+                cls.rollback()
+            raise
+        db.depth -= 1
+        if db.depth == 0:
+            if db.aborted:
+                db.aborted = False
+                cls.rollback()
+                logging.warn("Transaction rolled back after an error inside it")
+            else:
+                cls.commit()
+
+
+def releasing(fn):
+    '''Decorates a handler or job so the thread's connection goes back to the pool
+    when it returns'''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB.release()
+    return wrapper
+
+
+class Cursor(object):
+    '''Wraps the driver cursor of a thread's connection, translating the statements
+    for the backend and counting and timing every one sent to the server. A statement that
+    finds the connection gone is retried once on a new one, unless there were
+    writes not committed yet.'''
+    def __init__(self, db, tuples=False):
+        self.db = db
+        self.tuples = tuples
+        self.cursor = DB.backend.cursor(db.conn, tuples)
+
+    def run(self, method, statement, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._run(method, statement, *args, **kwargs)
+        finally:
+            DB.count_query(seconds=time.perf_counter() - start)
+
+    def _run(self, method, statement, *args, **kwargs):
+        sql = DB.backend.sql(statement)
+        retry = not self.db.dirty
+        self.db.pending = True
+        if not statement.lstrip()[:6].upper() == 'SELECT':
+            self.db.dirty = True
+        try:
+            return getattr(self.cursor, method)(sql, *args, **kwargs)
+        except Exception as e:
+            if not retry or not DB.backend.is_disconnect(e):
+                raise
+            logging.warn("Lost DB connection, reconnecting - {}".format(e))
+            self.db._reconnect()
+            self.db.cursors[self.tuples] = self
+            self.db.pending = True
+            self.db.dirty = not statement.lstrip()[:6].upper() == 'SELECT'
+            self.cursor = DB.backend.cursor(self.db.conn, self.tuples)
+            return getattr(self.cursor, method)(sql, *args, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        return self.run('execute', statement, *args, **kwargs)
+
+    def executemany(self, statement, *args, **kwargs):
+        return self.run('executemany', statement, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
 
 class Data(object):
-    def __init__(self, **kwargs):
+    def __init__(self, *args, **kwargs):
+        kwargs.update(zip(self._attrs(), args))
         for a in self._attrs():
             setattr(self, a, kwargs.get(a))
 
     def save(self):
         try:
             c = DB.cursor()
-            c.execute(self._insert(), self.__dict__)
+            for statement in self._statements():
+                c.execute(statement, self.__dict__)
             DB.commit()
+            self._saved()
         except Exception as e:
+            if DB.in_transaction():
+                raise
             DB.rollback()
             logging.warn("Error saving {} ({}) - {}".format(self.__class__.__name__, self.__dict__, e))
 
+    @classmethod
+    def save_many(cls, objs, chunk=500):
+        '''Saves the objects, of any Data classes, with executemany batches and a
+        single commit. Returns False, with nothing saved, if any of them fails'''
+        batches = collections.OrderedDict()
+        for obj in objs:
+            for statement in obj._statements():
+                batches.setdefault(statement, []).append(obj.__dict__)
+        try:
+            with DB.transaction():
+                c = DB.cursor()
+                for statement, rows in batches.items():
+                    for i in range(0, len(rows), chunk):
+                        c.executemany(statement, rows[i:i+chunk])
+        except Exception as e:
+            logging.warn("Error saving {} objects - {}".format(len(objs), e))
+            return False
+        for obj in objs:
+            obj._saved()
+        return True
+
+    def _statements(self):
+        '''Statements run with the attributes of the object to save it'''
+        return [self._insert()]
+
+    def _saved(self):
+        pass
+
     @classmethod
     def _make(cls, args):
         return cls(**args)
@@ -169,7 +606,7 @@ class UserFilter(Data):
 class Spawn(Data):
     @classmethod
     def _attrs(cls):
-        return [ 'encounter_id', 'expiration_timestamp', 'latitude', 'longitude', 
+        return [ 'id', 'encounter_id', 'expiration_timestamp', 'latitude', 'longitude', 
                 'name', 'spawn_point_id']
 
     @classmethod
@@ -183,6 +620,29 @@ class Spawn(Data):
     def register(cls, obj):
         Spawn(**obj).save()
 
+    @classmethod
+    def register_many(cls, objs, chunk=1000):
+        '''Inserts the spawns with multi-row statements of up to chunk rows and a single
+        commit. Spawns already known are left as they are. Returns how many were sent'''
+        columns = ['encounter_id', 'expiration_timestamp', 'latitude', 'longitude',
+                'name', 'spawn_point_id']
+        rows = [ [ obj.get(a) for a in columns ] for obj in objs ]
+        try:
+            c = DB.cursor()
+            for i in range(0, len(rows), chunk):
+                part = rows[i:i+chunk]
+                c.execute('''INSERT INTO spawns ({}) VALUES {}
+                                ON DUPLICATE KEY UPDATE name=name'''.format(
+                                    ', '.join(columns),
+                                    ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(part))),
+                                [ v for row in part for v in row ])
+            DB.commit()
+            return len(rows)
+        except Exception as e:
+            DB.rollback()
+            logging.warn("Error registering {} spawns - {}".format(len(rows), e))
+            raise
+
 
     @classmethod
     def all_active(cls):
@@ -194,12 +654,149 @@ class Spawn(Data):
             return cls(**dict(data))
         return map(creator, c.fetchall())
 
+    @classmethod
+    def since(cls, last_id):
+        '''Active spawns inserted after the spawn with id last_id, as SpawnRecords'''
+        c = DB.cursor(tuples=True)
+        c.execute('''SELECT {} FROM spawns 
+                        WHERE id > %s AND expiration_timestamp > UNIX_TIMESTAMP( NOW() ) 
+                        ORDER BY id ASC'''.format(', '.join(cls._attrs())), (last_id,))
+        return list(map(SpawnRecord._make, c.fetchall()))
+
+    @classmethod
+    def purge(cls, before, chunk=1000):
+        '''Deletes up to chunk spawns expired before the timestamp `before`, with their
+        notifications, in one short transaction. Returns (spawns, notifications) deleted'''
+        try:
+            c = DB.cursor()
+            c.execute('''SELECT encounter_id FROM spawns WHERE expiration_timestamp < %s
+                            ORDER BY expiration_timestamp ASC LIMIT %s''', (before, chunk))
+            ids = [data['encounter_id'] for data in c.fetchall()]
+            if not ids:
+                return 0, 0
+            marks = ', '.join(['%s'] * len(ids))
+            c.execute('DELETE FROM notifications WHERE encounter_id IN ({})'.format(marks), ids)
+            notifications = c.rowcount
+            c.execute('DELETE FROM spawns WHERE encounter_id IN ({})'.format(marks), ids)
+            spawns = c.rowcount
+            DB.commit()
+            return spawns, notifications
+        except Exception as e:
+            DB.rollback()
+            logging.warn("Error purging spawns - {}".format(e))
+            return 0, 0
+
 class Filter(Data):
     @classmethod
     def _attrs(cls):
         return [ 'internal_name', 'name' ]
+
             
+class UserCache(object):
+    '''LRU of users and of their filters, keyed by user id with a chat_id index, so
+    the handlers don't query the user and join the filters on every message. User
+    updates it after each write commits; entries also expire after ttl seconds, in
+    case something else changed the tables.'''
+    def __init__(self, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.users = collections.OrderedDict() # user_id -> (loaded, attrs)
+        self.filter_lists = collections.OrderedDict() # user_id -> (loaded, [Filter])
+        self.chats = {} # str(chat_id) -> user_id
+        self.stats = collections.Counter()
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config.get('user-cache', {})
+        return cls(size=conf.get('size', 1000), ttl=conf.get('ttl', 300))
+
+    def _get(self, entries, user_id, kind):
+        entry = entries.get(user_id)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            self.stats[kind + '_miss'] += 1
+            return None
+        entries.move_to_end(user_id)
+        self.stats[kind + '_hit'] += 1
+        return entry[1]
+
+    def _put(self, entries, user_id, value, loaded=None):
+        entries[user_id] = (time.time() if loaded is None else loaded, value)
+        entries.move_to_end(user_id)
+        while len(entries) > self.size:
+            old, (_, attrs) = entries.popitem(last=False)
+            if entries is self.users:
+                self._unindex(old, attrs)
+
+    def _unindex(self, user_id, attrs):
+        chat = str(attrs['chat_id'])
+        if self.chats.get(chat) == user_id:
+            del self.chats[chat]
+
+    def user(self, chat_id):
+        '''The cached attrs of the user with chat_id, None on a miss'''
+        with self.lock:
+            return self._get(self.users, self.chats.get(str(chat_id)), 'user')
+
+    def put_user(self, attrs):
+        with self.lock:
+            if attrs['id'] in self.users:
+                self._unindex(attrs['id'], self.users[attrs['id']][1])
+            self.chats[str(attrs['chat_id'])] = attrs['id']
+            self._put(self.users, attrs['id'], dict(attrs))
+
+    def drop_chat(self, chat_id):
+        with self.lock:
+            user_id = self.chats.pop(str(chat_id), None)
+            self.users.pop(user_id, None)
+
+    def filters(self, user_id):
+        '''The cached filters of user_id, None on a miss'''
+        with self.lock:
+            filters = self._get(self.filter_lists, user_id, 'filters')
+            return list(filters) if filters is not None else None
+
+    def put_filters(self, user_id, filters):
+        with self.lock:
+            self._put(self.filter_lists, user_id, list(filters))
+
+    def add_filter(self, user_id, f):
+        with self.lock:
+            entry = self.filter_lists.get(user_id)
+            if entry is not None and all(x.name != f.name for x in entry[1]):
+                self._put(self.filter_lists, user_id, entry[1] + [f], entry[0])
+
+    def del_filter(self, user_id, name):
+        with self.lock:
+            entry = self.filter_lists.get(user_id)
+            if entry is not None:
+                self._put(self.filter_lists, user_id,
+                        [x for x in entry[1] if x.name != name], entry[0])
+
+    def drop_filters(self, user_id):
+        with self.lock:
+            self.filter_lists.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.filter_lists.clear()
+            self.chats.clear()
+
+    def metrics(self):
+        with self.lock:
+            m = dict(self.stats)
+            m['users'] = len(self.users)
+            m['filter_lists'] = len(self.filter_lists)
+        for k in ('user_hit', 'user_miss', 'filters_hit', 'filters_miss'):
+            m.setdefault(k, 0)
+        return m
+
+
 class User(Data):
+    # replaced with UserCache.from_config() by the bot
+    cache = UserCache()
+
     @classmethod
     def _attrs(cls):
         return  [ 'id', 'first_name', 'last_name', 'username', 'chat_id', 'distance' ]
@@ -216,13 +813,21 @@ class User(Data):
                         chat_id = %(chat_id)s,
                         distance = %(distance)s'''
 
+    def _saved(self):
+        if self.id is None:
+            # the id comes from AUTO_INCREMENT, find() loads it again
+            User.cache.drop_chat(self.chat_id)
+        else:
+            User.cache.put_user({ a: getattr(self, a) for a in self._attrs() })
+
     def update_position(self, latitude, longitude):
+        # UserPosition.cache is updated by the save
         self.last_pos = UserPosition(user_id=self.id, timestamp=time.time(), 
                 latitude=latitude, longitude=longitude)
         self.last_pos.save()
 
     def position(self):
-        if not hasattr(self, 'last_pos') or self.last_pos == None:
+        if not hasattr(self, 'last_pos'):
             self.last_pos = UserPosition.get_last(self.id)
         return self.last_pos
 
@@ -231,6 +836,11 @@ class User(Data):
             c = DB.cursor()
             c.execute('INSERT INTO user_filters VALUES ( %s , %s )', (self.id, pokemon_id))
             DB.commit()
+            poke = Pokemon.find(pokemon_id)
+            if poke is None:
+                User.cache.drop_filters(self.id)
+            else:
+                User.cache.add_filter(self.id, Filter(poke.internal_name, poke.name))
         except Exception as e:
             DB.rollback()
             logging.warning("Could not insert filter for user: {} - {} ({})".format(
@@ -244,18 +854,28 @@ class User(Data):
             c.execute('DELETE FROM user_filters WHERE user_id=%s AND pokemon_id=%s', 
                     (self.id, pokemon_id))
             DB.commit()
-        except Exceptino as e:
+            poke = Pokemon.find(pokemon_id)
+            if poke is None:
+                User.cache.drop_filters(self.id)
+            else:
+                User.cache.del_filter(self.id, poke.name)
+        except Exception as e:
             DB.rollback()
+            # the delete may have gone through, read them again next time
+            User.cache.drop_filters(self.id)
             logging.warning("Could not remove filter for user: {} - {} ({})".format(
                 self.username, pokemon_id, e))
 
     def filters(self):
-        c = DB.cursor()
-        c.execute('''SELECT internal_name, name FROM user_filters AS f
-                    LEFT JOIN pokemons AS p ON p.id = f.pokemon_id
-                    WHERE user_id=%s''', (self.id,) )
-        
-        return map(Filter._make, c.fetchall())
+        filters = User.cache.filters(self.id)
+        if filters is None:
+            c = DB.cursor()
+            c.execute('''SELECT internal_name, name FROM user_filters AS f
+                        LEFT JOIN pokemons AS p ON p.id = f.pokemon_id
+                        WHERE user_id=%s''', (self.id,) )
+            filters = list(map(Filter._make, c.fetchall()))
+            User.cache.put_filters(self.id, filters)
+        return iter(filters)
 
     def notify(self, encounter_id):
         c = DB.cursor()
@@ -270,8 +890,10 @@ class User(Data):
 
     @classmethod
     def new(cls, first, last, user, chat_id, distance=1000):
-        return User( id=None, first_name=first, last_name=last, username=user, 
+        '''Saves a new user and returns it with the id it got, None if it could not'''
+        User( id=None, first_name=first, last_name=last, username=user, 
                 chat_id=chat_id, distance=distance).save()
+        return cls.find(chat_id)
 
     @classmethod
     def all(cls):
@@ -282,17 +904,92 @@ class User(Data):
         return map(creator, cursor.fetchall())
 
 
+    @classmethod
+    def snapshot(cls):
+        '''All users as UserRecords, with their last position and filters, in three
+        queries no matter how many users there are'''
+        cursor = DB.cursor(tuples=True)
+        cursor.execute('SELECT {} FROM `users`'.format(', '.join(cls._attrs())))
+        users = cursor.fetchall()
+
+        positions = UserPosition.all_last()
+
+        cursor.execute('''SELECT user_id, internal_name, name FROM user_filters AS f
+                    LEFT JOIN pokemons AS p ON p.id = f.pokemon_id''')
+        filters = collections.defaultdict(list)
+        for user_id, internal_name, name in cursor.fetchall():
+            filters[user_id].append(FilterRecord(internal_name, name))
+
+        return [UserRecord(*(row + (positions.get(row[0]), filters[row[0]]))) for row in users]
+
     @classmethod
     def find(cls,chat_id):
-        cursor = DB.cursor()
-        cursor.execute('SELECT * from `users` where `chat_id`=%s', (chat_id,))
-        data = cursor.fetchone()
-        if data == None:
+        data = User.cache.user(chat_id)
+        if data is None:
+            cursor = DB.cursor()
+            cursor.execute('SELECT * from `users` where `chat_id`=%s', (chat_id,))
+            data = cursor.fetchone()
+            if data == None:
+                return None
+            data = dict(data)
+            User.cache.put_user(data)
+        return User(**data)
+
+
+class NotificationLog(object):
+    '''The (encounter_id, user_id) pairs already sent, kept in memory and loaded once
+    from the notifications table, so a tick checks all its candidates without a
+    query each and persists the new ones in one batch.'''
+    def __init__(self):
+        self.sent = None # (encounter_id, user_id) -> expiration_timestamp
+
+    def load(self):
+        c = DB.cursor()
+        c.execute('''SELECT n.encounter_id, n.user_id, s.expiration_timestamp
+                        FROM notifications AS n
+                        JOIN spawns AS s ON s.encounter_id = n.encounter_id
+                        WHERE s.expiration_timestamp > %s''', (int(time.time()),) )
+        self.sent = { (d['encounter_id'], d['user_id']): d['expiration_timestamp']
+                for d in c.fetchall() }
+
+    def expire(self, now):
+        self.sent = { k: exp for k, exp in self.sent.items() if exp > now }
+
+    def record(self, pairs):
+        '''Takes [(encounter_id, user_id, expiration_timestamp)] and returns the set of
+        (encounter_id, user_id) not sent before, after saving them to the DB.
+        Returns None if they could not be saved.'''
+        if self.sent is None:
+            self.load()
+        else:
+            self.expire(time.time())
+
+        new = {}
+        for encounter_id, user_id, exp in pairs:
+            key = (encounter_id, user_id)
+            if key not in self.sent:
+                new[key] = exp
+        if not new:
+            return set()
+
+        try:
+            with DB.transaction():
+                c = DB.cursor()
+                c.executemany('''INSERT IGNORE INTO notifications (encounter_id, user_id)
+                                    VALUES ( %s, %s )''', list(new.keys()) )
+        except Exception as e:
+            logging.warn("Error saving {} notifications - {}".format(len(new), e))
             return None
-        return User(**dict(data))
+
+        self.sent.update(new)
+        return set(new.keys())
 
 
 class UserPosition(Data):
+    # PositionRecord of the last position of each user, kept up to date by save()
+    cache = {}
+    cache_loaded = False
+
     @classmethod
     def _attrs(cls):
         return [ 'user_id', 'timestamp', 'latitude', 'longitude' ] 
@@ -302,15 +999,88 @@ class UserPosition(Data):
         return '''INSERT INTO `user_positions` (user_id, timestamp, latitude, longitude) 
                     VALUES (%(user_id)s, %(timestamp)s, %(latitude)s, %(longitude)s)'''
 
+    @classmethod
+    def _upsert(cls):
+        return '''INSERT INTO `user_current_position` (user_id, timestamp, latitude, longitude)
+                    VALUES (%(user_id)s, %(timestamp)s, %(latitude)s, %(longitude)s)
+                    ON DUPLICATE KEY UPDATE
+                        timestamp = %(timestamp)s,
+                        latitude = %(latitude)s,
+                        longitude = %(longitude)s'''
+
+    @classmethod
+    def history(cls):
+        '''"position-history" settings: {"enabled": bool, "retention-days": int}'''
+        conf = { 'enabled': True, 'retention-days': 30 }
+        conf.update(DB.config().get('position-history', {}))
+        return conf
+
+    def _statements(self):
+        if self.history()['enabled']:
+            return [self._upsert(), self._insert()]
+        return [self._upsert()]
+
+    def _saved(self):
+        UserPosition.cache[self.user_id] = PositionRecord(self.user_id, self.timestamp,
+                self.latitude, self.longitude)
+
     @classmethod
     def get_last(cls, user_id):
-        c = DB.cursor()
-        c.execute('''SELECT * FROM user_positions WHERE user_id=%(user_id)s
-                        ORDER BY timestamp DESC LIMIT 1''', {'user_id': user_id} )
+        if user_id in cls.cache:
+            return cls.cache[user_id]
+        c = DB.cursor(tuples=True)
+        c.execute('''SELECT user_id, timestamp, latitude, longitude FROM user_current_position
+                        WHERE user_id=%(user_id)s''', {'user_id': user_id} )
         data = c.fetchone()
         if data == None:
             return None
-        return UserPosition(**dict(data))
+        cls.cache[user_id] = PositionRecord._make(data)
+        return cls.cache[user_id]
+
+    @classmethod
+    def all_last(cls):
+        '''Last position of every user, as a dict by user_id'''
+        if not cls.cache_loaded:
+            c = DB.cursor(tuples=True)
+            c.execute('SELECT user_id, timestamp, latitude, longitude FROM user_current_position')
+            for data in c.fetchall():
+                cls.cache.setdefault(data[0], PositionRecord._make(data))
+            cls.cache_loaded = True
+        return dict(cls.cache)
+
+    @classmethod
+    def prune(cls, retention_days=None, chunk=1000):
+        '''Deletes up to chunk rows of history older than retention_days, returns how
+        many were deleted'''
+        if retention_days is None:
+            retention_days = cls.history()['retention-days']
+        try:
+            c = DB.cursor()
+            c.execute('DELETE FROM user_positions WHERE timestamp < %s LIMIT %s',
+                    (time.time() - retention_days * 86400, chunk) )
+            DB.commit()
+            return c.rowcount
+        except Exception as e:
+            DB.rollback()
+            logging.warn("Error pruning position history - {}".format(e))
+            return 0
+
+
+# Read-only records for the bulk queries of the periodic check, built straight
+# from tuple rows: no per-instance __dict__ like the Data objects above
+SpawnRecord = collections.namedtuple('SpawnRecord', Spawn._attrs())
+FilterRecord = collections.namedtuple('FilterRecord', Filter._attrs())
+PositionRecord = collections.namedtuple('PositionRecord', UserPosition._attrs())
+
+class UserRecord(collections.namedtuple('UserRecord',
+        User._attrs() + [ 'last_pos', 'filter_list' ])):
+    __slots__ = ()
+
+    def position(self):
+        return self.last_pos
+
+    def filters(self):
+        return iter(self.filter_list)
 
 
 class Pokemon(Data):
@@ -340,23 +1110,53 @@ class Pokemon(Data):
     #         DB.rollback()
     #         logging.warn("Error saving pokemon({}) - {}".format(self.__dict__, e))
 
+    # the pokemons table only changes when pokedb_data.py runs, so it is kept in
+    # memory: (pokemons by id order, {id: pokemon}, {lowercase name: pokemon})
+    catalogue = None
+    catalogue_loaded = 0
+    catalogue_lock = threading.Lock()
+    # bumped on every reload, for caches built from the catalogue
+    generation = 0
+
+    def _saved(self):
+        Pokemon.invalidate()
+
+    @classmethod
+    def invalidate(cls):
+        with cls.catalogue_lock:
+            cls.catalogue = None
+
+    @classmethod
+    def _catalogue(cls):
+        with cls.catalogue_lock:
+            # other processes (pokedb_data.py) can't invalidate it, so it also expires
+            ttl = DB.config().get('catalogue-ttl', 600)
+            if cls.catalogue is None or time.time() - cls.catalogue_loaded > ttl:
+                c = DB.cursor()
+                c.execute('SELECT * from `pokemons` ORDER BY id ASC')
+                pokes = list(map(Pokemon._make, c.fetchall()))
+                names = {}
+                for p in pokes:
+                    for n in (p.internal_name, p.name):
+                        if n:
+                            names.setdefault(n.lower(), p)
+                cls.catalogue = (pokes, { p.id: p for p in pokes }, names)
+                cls.catalogue_loaded = time.time()
+                cls.generation += 1
+            return cls.catalogue
+
     @classmethod
     def all(cls):
-        c = DB.cursor()
-        c.execute('SELECT * from `pokemons` ORDER BY id ASC')
-        return map(Pokemon._make, c.fetchall())
+        return iter(cls._catalogue()[0])
 
     @classmethod
     def find(cls, pokeid):
-        cursor = DB.cursor()
-        cursor.execute('SELECT * from `pokemons` where id = %s', (pokeid,))
-        return Pokemon._make(cursor.fetchone())
+        return cls._catalogue()[1].get(int(pokeid))
 
     @classmethod
     def by_name(cls,name):
-        cursor = DB.cursor()
-        cursor.execute('SELECT * from `pokemons` where internal_name LIKE %s or name LIKE %s', (name,name))
-        return Pokemon._make(cursor.fetchone())
+        '''Case-insensitive lookup by name or internal_name, None if there is no such pokemon'''
+        return cls._catalogue()[2].get(name.strip().lower())
 
 
 class LocationGroup(Data):
@@ -452,5 +1252,23 @@ class Location(Data):
         cursor.execute('SELECT * from `location` where id = %s LIMIT 1', (loc_id,))
         return LocationGroup._make(cursor.fetchone())
 
+    @classmethod
+    def areas(cls):
+        '''{location_group_id: [(latitude, longitude)]} of every location'''
+        c = DB.cursor(tuples=True)
+        c.execute('SELECT location_group_id, latitude, longitude FROM locations')
+        areas = {}
+        for group_id, latitude, longitude in c.fetchall():
+            areas.setdefault(group_id, []).append((float(latitude), float(longitude)))
+        return areas
+
+    @classmethod
+    def fingerprint(cls):
+        '''Changes when a location is added, removed or moved, in one cheap query'''
+        c = DB.cursor(tuples=True)
+        c.execute('''SELECT COUNT(*), MAX(id), SUM(location_group_id), SUM(latitude),
+                SUM(longitude) FROM locations''')
+        return tuple(c.fetchone())
+
          
 
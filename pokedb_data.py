@@ -3,157 +3,159 @@ import sqlite3
 
 
 def insert_pokemon():
-    Pokemon( 1,    'Bulbasaur',         'BULBASAUR',    2).save()
-    Pokemon( 2,    'Ivysaur',           'IVYSAUR',      3).save()
-    Pokemon( 3,    'Venusaur',          'VENUSAUR',     4).save()
-    Pokemon( 4,    'Charmander',        'CHARMANDER',   3).save()
-    Pokemon( 5,    'Charmeleon',        'CHARMELEON',   4).save()
-    Pokemon( 6,    'Charizard',         'CHARIZARD',    4).save()
-    Pokemon( 7,    'Squirtle',          'SQUIRTLE',     2).save()
-    Pokemon( 8,    'Wartortle',         'WARTORTLE',    3).save()
-    Pokemon( 9,    'Blastoise',         'BLASTOISE',    4).save()
-    Pokemon( 10,   'Caterpie',          'CATERPIE',     1).save()
-    Pokemon( 11,   'Metapod',           'METAPOD',      3).save()
-    Pokemon( 12,   'Butterfree',        'BUTTERFREE',   4).save()
-    Pokemon( 13,   'Weedle',            'WEEDLE',       1).save()
-    Pokemon( 14,   'Kakuna',            'KAKUNA',       3).save()
-    Pokemon( 15,   'Beedrill',          'BEEDRILL',     3).save()
-    Pokemon( 16,   'Pidgey',            'PIDGEY',       1).save()
-    Pokemon( 17,   'Pidgeotto',         'PIDGEOTTO',    2).save()
-    Pokemon( 18,   'Pidgeot',           'PIDGEOT',      3).save()
-    Pokemon( 19,   'Rattata',           'RATTATA',      1).save()
-    Pokemon( 20,   'Raticate',          'RATICATE',     3).save()
-    Pokemon( 21,   'Spearow',           'SPEAROW',      1).save()
-    Pokemon( 22,   'Fearow',            'FEAROW',       3).save()
-    Pokemon( 23,   'Ekans',             'EKANS',        2).save()
-    Pokemon( 24,   'Arbok',             'ARBOK',        4).save()
-    Pokemon( 25,   'Pikachu',           'PIKACHU',      3).save()
-    Pokemon( 26,   'Raichu',            'RAICHU',       5).save()
-    Pokemon( 27,   'Sandshrew',         'SANDSHREW',    3).save()
-    Pokemon( 28,   'Sandslash',         'SANDSLASH',    5).save()
-    Pokemon( 29,   'NidoranFem',        'NIDORAN_FEMALE', 2).save()
-    Pokemon( 30,   'Nidorina',          'NIDORINA',     4).save()
-    Pokemon( 31,   'Nidoqueen',         'NIDOQUEEN',    4).save()
-    Pokemon( 32,   'NidoranMale',       'NIDORAN_MALE', 2).save()
-    Pokemon( 33,   'Nidorino',          'NIDORINO',     4).save()
-    Pokemon( 34,   'Nidoking',          'NIDOKING',     4).save()
-    Pokemon( 35,   'Clefairy',          'CLEFAIRY',     2).save()
-    Pokemon( 36,   'Clefable',          'CLEFABLE',     4).save()
-    Pokemon( 37,   'Vulpix',            'VULPIX',       3).save()
-    Pokemon( 38,   'Ninetales',         'NINETALES',    5).save()
-    Pokemon( 39,   'Jigglypuff',        'JIGGLYPUFF',   3).save()
-    Pokemon( 40,   'Wigglytuff',        'WIGGLYTUFF',   5).save()
-    Pokemon( 41,   'Zubat',             'ZUBAT',        1).save()
-    Pokemon( 42,   'Golbat',            'GOLBAT',       3).save()
-    Pokemon( 43,   'Oddish',            'ODDISH',       2).save()
-    Pokemon( 44,   'Gloom',             'GLOOM',        4).save()
-    Pokemon( 45,   'Vileplume',         'VILEPLUME',    5).save()
-    Pokemon( 46,   'Paras',             'PARAS',        2).save()
-    Pokemon( 47,   'Parasect',          'PARASECT',     3).save()
-    Pokemon( 48,   'Venonat',           'VENONAT',      2).save()
-    Pokemon( 49,   'Venomoth',          'VENOMOTH',     3).save()
-    Pokemon( 50,   'Diglett',           'DIGLETT',      3).save()
-    Pokemon( 51,   'Dugtrio',           'DUGTRIO',      5).save()
-    Pokemon( 52,   'Meowth',            'MEOWTH',       3).save()
-    Pokemon( 53,   'Persian',           'PERSIAN',      4).save()
-    Pokemon( 54,   'Psyduck',           'PSYDUCK',      3).save()
-    Pokemon( 55,   'Golduck',           'GOLDUCK',      4).save()
-    Pokemon( 56,   'Mankey',            'MANKEY',       3).save()
-    Pokemon( 57,   'Primeape',          'PRIMEAPE',     4).save()
-    Pokemon( 58,   'Growlithe',         'GROWLITHE',    3).save()
-    Pokemon( 59,   'Arcanine',          'ARCANINE',     4).save()
-    Pokemon( 60,   'Poliwag',           'POLIWAG',      2).save()
-    Pokemon( 61,   'Poliwhirl',         'POLIWHIRL',    3).save()
-    Pokemon( 62,   'Poliwrath',         'POLIWRATH',    5).save()
-    Pokemon( 63,   'Abra',              'ABRA',         3).save()
-    Pokemon( 64,   'Kadabra',           'KADABRA',      4).save()
-    Pokemon( 65,   'Alakazam',          'ALAKAZAM',     5).save()
-    Pokemon( 66,   'Machop',            'MACHOP',       3).save()
-    Pokemon( 67,   'Machoke',           'MACHOKE',      4).save()
-    Pokemon( 68,   'Machamp',           'MACHAMP',      5).save()
-    Pokemon( 69,   'Bellsprout',        'BELLSPROUT',   2).save()
-    Pokemon( 70,   'Weepinbell',        'WEEPINBELL',   3).save()
-    Pokemon( 71,   'Victreebel',        'VICTREEBEL',   5).save()
-    Pokemon( 72,   'Tentacool',         'TENTACOOL',    3).save()
-    Pokemon( 73,   'Tentacruel',        'TENTACRUEL',   4).save()
-    Pokemon( 74,   'Geodude',           'GEODUDE',      3).save()
-    Pokemon( 75,   'Graveler',          'GRAVELER',     4).save()
-    Pokemon( 76,   'Golem',             'GOLEM',        5).save()
-    Pokemon( 77,   'Ponyta',            'PONYTA',       3).save()
-    Pokemon( 78,   'Rapidash',          'RAPIDASH',     4).save()
-    Pokemon( 79,   'Slowpoke',          'SLOWPOKE',     3).save()
-    Pokemon( 80,   'Slowbro',           'SLOWBRO',      4).save()
-    Pokemon( 81,   'Magnemite',         'MAGNEMITE',    3).save()
-    Pokemon( 82,   'Magneton',          'MAGNETON',     5).save()
-    Pokemon( 83,   'Farfetch\'d',       'FARFETCHD',    5).save()
-    Pokemon( 84,   'Doduo',             'DODUO',        2).save()
-    Pokemon( 85,   'Dodrio',            'DODRIO',       4).save()
-    Pokemon( 86,   'Seel',              'SEEL',         3).save()
-    Pokemon( 87,   'Dewgong',           'DEWGONG',      5).save()
-    Pokemon( 88,   'Grimer',            'GRIMER',       4).save()
-    Pokemon( 89,   'Muk',               'MUK',          5).save()
-    Pokemon( 90,   'Shellder',          'SHELLDER',     3).save()
-    Pokemon( 91,   'Cloyster',          'CLOYSTER',     5).save()
-    Pokemon( 92,   'Gastly',            'GASTLY',       2).save()
-    Pokemon( 93,   'Haunter',           'HAUNTER',      3).save()
-    Pokemon( 94,   'Gengar',            'GENGAR',       5).save()
-    Pokemon( 95,   'Onix',              'ONIX',         3).save()
-    Pokemon( 96,   'Drowzee',           'DROWZEE',      3).save()
-    Pokemon( 97,   'Hypno',             'HYPNO',        3).save()
-    Pokemon( 98,   'Krabby',            'KRABBY',       2).save()
-    Pokemon( 99,   'Kingler',           'KINGLER',      4).save()
-    Pokemon( 100,  'Voltorb',           'VOLTORB',      3).save()
-    Pokemon( 101,  'Electrode',         'ELECTRODE',    5).save()
-    Pokemon( 102,  'Exeggcute',         'EXEGGCUTE',    3).save()
-    Pokemon( 103,  'Exeggutor',         'EXEGGUTOR',    4).save()
-    Pokemon( 104,  'Cubone',            'CUBONE',       3).save()
-    Pokemon( 105,  'Marowak',           'MAROWAK',      4).save()
-    Pokemon( 106,  'Hitmonlee',         'HITMONLEE',    4).save()
-    Pokemon( 107,  'Hitmonchan',        'HITMONCHAN',   3).save()
-    Pokemon( 108,  'Lickitung',         'LICKITUNG',    3).save()
-    Pokemon( 109,  'Koffing',           'KOFFING',      3).save()
-    Pokemon( 110,  'Weezing',           'WEEZING',      4).save()
-    Pokemon( 111,  'Rhyhorn',           'RHYHORN',      3).save()
-    Pokemon( 112,  'Rhydon',            'RHYDON',       4).save()
-    Pokemon( 113,  'Chansey',           'CHANSEY',      4).save()
-    Pokemon( 114,  'Tangela',           'TANGELA',      3).save()
-    Pokemon( 115,  'Kangaskhan',        'KANGASKHAN',   5).save()
-    Pokemon( 116,  'Horsea',            'HORSEA',       3).save()
-    Pokemon( 117,  'Seadra',            'SEADRA',       4).save()
-    Pokemon( 118,  'Goldeen',           'GOLDEEN',      3).save()
-    Pokemon( 119,  'Seaking',           'SEAKING',      4).save()
-    Pokemon( 120,  'Staryu',            'STARYU',       2).save()
-    Pokemon( 121,  'Starmie',           'STARMIE',      4).save()
-    Pokemon( 122,  'MrMime',            'MR_MIME',      4).save()
-    Pokemon( 123,  'Scyther',           'SCYTHER',      3).save()
-    Pokemon( 124,  'Jynx',              'JYNX',         3).save()
-    Pokemon( 125,  'Electabuzz',        'ELECTABUZZ',   3).save()
-    Pokemon( 126,  'Magmar',            'MAGMAR',       3).save()
-    Pokemon( 127,  'Pinsir',            'PINSIR',       2).save()
-    Pokemon( 128,  'Tauros',            'TAUROS',       3).save()
-    Pokemon( 129,  'Magikarp',          'MAGIKARP',     2).save()
-    Pokemon( 130,  'Gyarados',          'GYARADOS',     5).save()
-    Pokemon( 131,  'Lapras',            'LAPRAS',       4).save()
-    Pokemon( 132,  'Ditto',             'DITTO',        5).save()
-    Pokemon( 133,  'Eevee',             'EEVEE',        2).save()
-    Pokemon( 134,  'Vaporeon',          'VAPOREON',     4).save()
-    Pokemon( 135,  'Jolteon',           'JOLTEON',      4).save()
-    Pokemon( 136,  'Flareon',           'FLAREON',      5).save()
-    Pokemon( 137,  'Porygon',           'PORYGON',      4).save()
-    Pokemon( 138,  'Omanyte',           'OMANYTE',      3).save()
-    Pokemon( 139,  'Omastar',           'OMASTAR',      5).save()
-    Pokemon( 140,  'Kabuto',            'KABUTO',       3).save()
-    Pokemon( 141,  'Kabutops',          'KABUTOPS',     5).save()
-    Pokemon( 142,  'Aerodactyl',        'AERODACTYL',   4).save()
-    Pokemon( 143,  'Snorlax',           'SNORLAX',      3).save()
-    Pokemon( 144,  'Articuno',          'ARTICUNO',     5).save()
-    Pokemon( 145,  'Zapdos',            'ZAPDOS',       5).save()
-    Pokemon( 146,  'Moltres',           'MOLTRES',      5).save()
-    Pokemon( 147,  'Dratini',           'DRATINI',      3).save()
-    Pokemon( 148,  'Dragonair',         'DRAGONAIR',    4).save()
-    Pokemon( 149,  'Dragonite',         'DRAGONITE',    4).save()
-    Pokemon( 150,  'Mewtwo',            'MEWTWO',       5).save()
-    Pokemon( 151,  'Mew',               'MEW',          5).save()
+    Pokemon.save_many([
+        Pokemon( 1,    'Bulbasaur',         'BULBASAUR',    2),
+        Pokemon( 2,    'Ivysaur',           'IVYSAUR',      3),
+        Pokemon( 3,    'Venusaur',          'VENUSAUR',     4),
+        Pokemon( 4,    'Charmander',        'CHARMANDER',   3),
+        Pokemon( 5,    'Charmeleon',        'CHARMELEON',   4),
+        Pokemon( 6,    'Charizard',         'CHARIZARD',    4),
+        Pokemon( 7,    'Squirtle',          'SQUIRTLE',     2),
+        Pokemon( 8,    'Wartortle',         'WARTORTLE',    3),
+        Pokemon( 9,    'Blastoise',         'BLASTOISE',    4),
+        Pokemon( 10,   'Caterpie',          'CATERPIE',     1),
+        Pokemon( 11,   'Metapod',           'METAPOD',      3),
+        Pokemon( 12,   'Butterfree',        'BUTTERFREE',   4),
+        Pokemon( 13,   'Weedle',            'WEEDLE',       1),
+        Pokemon( 14,   'Kakuna',            'KAKUNA',       3),
+        Pokemon( 15,   'Beedrill',          'BEEDRILL',     3),
+        Pokemon( 16,   'Pidgey',            'PIDGEY',       1),
+        Pokemon( 17,   'Pidgeotto',         'PIDGEOTTO',    2),
+        Pokemon( 18,   'Pidgeot',           'PIDGEOT',      3),
+        Pokemon( 19,   'Rattata',           'RATTATA',      1),
+        Pokemon( 20,   'Raticate',          'RATICATE',     3),
+        Pokemon( 21,   'Spearow',           'SPEAROW',      1),
+        Pokemon( 22,   'Fearow',            'FEAROW',       3),
+        Pokemon( 23,   'Ekans',             'EKANS',        2),
+        Pokemon( 24,   'Arbok',             'ARBOK',        4),
+        Pokemon( 25,   'Pikachu',           'PIKACHU',      3),
+        Pokemon( 26,   'Raichu',            'RAICHU',       5),
+        Pokemon( 27,   'Sandshrew',         'SANDSHREW',    3),
+        Pokemon( 28,   'Sandslash',         'SANDSLASH',    5),
+        Pokemon( 29,   'NidoranFem',        'NIDORAN_FEMALE', 2),
+        Pokemon( 30,   'Nidorina',          'NIDORINA',     4),
+        Pokemon( 31,   'Nidoqueen',         'NIDOQUEEN',    4),
+        Pokemon( 32,   'NidoranMale',       'NIDORAN_MALE', 2),
+        Pokemon( 33,   'Nidorino',          'NIDORINO',     4),
+        Pokemon( 34,   'Nidoking',          'NIDOKING',     4),
+        Pokemon( 35,   'Clefairy',          'CLEFAIRY',     2),
+        Pokemon( 36,   'Clefable',          'CLEFABLE',     4),
+        Pokemon( 37,   'Vulpix',            'VULPIX',       3),
+        Pokemon( 38,   'Ninetales',         'NINETALES',    5),
+        Pokemon( 39,   'Jigglypuff',        'JIGGLYPUFF',   3),
+        Pokemon( 40,   'Wigglytuff',        'WIGGLYTUFF',   5),
+        Pokemon( 41,   'Zubat',             'ZUBAT',        1),
+        Pokemon( 42,   'Golbat',            'GOLBAT',       3),
+        Pokemon( 43,   'Oddish',            'ODDISH',       2),
+        Pokemon( 44,   'Gloom',             'GLOOM',        4),
+        Pokemon( 45,   'Vileplume',         'VILEPLUME',    5),
+        Pokemon( 46,   'Paras',             'PARAS',        2),
+        Pokemon( 47,   'Parasect',          'PARASECT',     3),
+        Pokemon( 48,   'Venonat',           'VENONAT',      2),
+        Pokemon( 49,   'Venomoth',          'VENOMOTH',     3),
+        Pokemon( 50,   'Diglett',           'DIGLETT',      3),
+        Pokemon( 51,   'Dugtrio',           'DUGTRIO',      5),
+        Pokemon( 52,   'Meowth',            'MEOWTH',       3),
+        Pokemon( 53,   'Persian',           'PERSIAN',      4),
+        Pokemon( 54,   'Psyduck',           'PSYDUCK',      3),
+        Pokemon( 55,   'Golduck',           'GOLDUCK',      4),
+        Pokemon( 56,   'Mankey',            'MANKEY',       3),
+        Pokemon( 57,   'Primeape',          'PRIMEAPE',     4),
+        Pokemon( 58,   'Growlithe',         'GROWLITHE',    3),
+        Pokemon( 59,   'Arcanine',          'ARCANINE',     4),
+        Pokemon( 60,   'Poliwag',           'POLIWAG',      2),
+        Pokemon( 61,   'Poliwhirl',         'POLIWHIRL',    3),
+        Pokemon( 62,   'Poliwrath',         'POLIWRATH',    5),
+        Pokemon( 63,   'Abra',              'ABRA',         3),
+        Pokemon( 64,   'Kadabra',           'KADABRA',      4),
+        Pokemon( 65,   'Alakazam',          'ALAKAZAM',     5),
+        Pokemon( 66,   'Machop',            'MACHOP',       3),
+        Pokemon( 67,   'Machoke',           'MACHOKE',      4),
+        Pokemon( 68,   'Machamp',           'MACHAMP',      5),
+        Pokemon( 69,   'Bellsprout',        'BELLSPROUT',   2),
+        Pokemon( 70,   'Weepinbell',        'WEEPINBELL',   3),
+        Pokemon( 71,   'Victreebel',        'VICTREEBEL',   5),
+        Pokemon( 72,   'Tentacool',         'TENTACOOL',    3),
+        Pokemon( 73,   'Tentacruel',        'TENTACRUEL',   4),
+        Pokemon( 74,   'Geodude',           'GEODUDE',      3),
+        Pokemon( 75,   'Graveler',          'GRAVELER',     4),
+        Pokemon( 76,   'Golem',             'GOLEM',        5),
+        Pokemon( 77,   'Ponyta',            'PONYTA',       3),
+        Pokemon( 78,   'Rapidash',          'RAPIDASH',     4),
+        Pokemon( 79,   'Slowpoke',          'SLOWPOKE',     3),
+        Pokemon( 80,   'Slowbro',           'SLOWBRO',      4),
+        Pokemon( 81,   'Magnemite',         'MAGNEMITE',    3),
+        Pokemon( 82,   'Magneton',          'MAGNETON',     5),
+        Pokemon( 83,   'Farfetch\'d',       'FARFETCHD',    5),
+        Pokemon( 84,   'Doduo',             'DODUO',        2),
+        Pokemon( 85,   'Dodrio',            'DODRIO',       4),
+        Pokemon( 86,   'Seel',              'SEEL',         3),
+        Pokemon( 87,   'Dewgong',           'DEWGONG',      5),
+        Pokemon( 88,   'Grimer',            'GRIMER',       4),
+        Pokemon( 89,   'Muk',               'MUK',          5),
+        Pokemon( 90,   'Shellder',          'SHELLDER',     3),
+        Pokemon( 91,   'Cloyster',          'CLOYSTER',     5),
+        Pokemon( 92,   'Gastly',            'GASTLY',       2),
+        Pokemon( 93,   'Haunter',           'HAUNTER',      3),
+        Pokemon( 94,   'Gengar',            'GENGAR',       5),
+        Pokemon( 95,   'Onix',              'ONIX',         3),
+        Pokemon( 96,   'Drowzee',           'DROWZEE',      3),
+        Pokemon( 97,   'Hypno',             'HYPNO',        3),
+        Pokemon( 98,   'Krabby',            'KRABBY',       2),
+        Pokemon( 99,   'Kingler',           'KINGLER',      4),
+        Pokemon( 100,  'Voltorb',           'VOLTORB',      3),
+        Pokemon( 101,  'Electrode',         'ELECTRODE',    5),
+        Pokemon( 102,  'Exeggcute',         'EXEGGCUTE',    3),
+        Pokemon( 103,  'Exeggutor',         'EXEGGUTOR',    4),
+        Pokemon( 104,  'Cubone',            'CUBONE',       3),
+        Pokemon( 105,  'Marowak',           'MAROWAK',      4),
+        Pokemon( 106,  'Hitmonlee',         'HITMONLEE',    4),
+        Pokemon( 107,  'Hitmonchan',        'HITMONCHAN',   3),
+        Pokemon( 108,  'Lickitung',         'LICKITUNG',    3),
+        Pokemon( 109,  'Koffing',           'KOFFING',      3),
+        Pokemon( 110,  'Weezing',           'WEEZING',      4),
+        Pokemon( 111,  'Rhyhorn',           'RHYHORN',      3),
+        Pokemon( 112,  'Rhydon',            'RHYDON',       4),
+        Pokemon( 113,  'Chansey',           'CHANSEY',      4),
+        Pokemon( 114,  'Tangela',           'TANGELA',      3),
+        Pokemon( 115,  'Kangaskhan',        'KANGASKHAN',   5),
+        Pokemon( 116,  'Horsea',            'HORSEA',       3),
+        Pokemon( 117,  'Seadra',            'SEADRA',       4),
+        Pokemon( 118,  'Goldeen',           'GOLDEEN',      3),
+        Pokemon( 119,  'Seaking',           'SEAKING',      4),
+        Pokemon( 120,  'Staryu',            'STARYU',       2),
+        Pokemon( 121,  'Starmie',           'STARMIE',      4),
+        Pokemon( 122,  'MrMime',            'MR_MIME',      4),
+        Pokemon( 123,  'Scyther',           'SCYTHER',      3),
+        Pokemon( 124,  'Jynx',              'JYNX',         3),
+        Pokemon( 125,  'Electabuzz',        'ELECTABUZZ',   3),
+        Pokemon( 126,  'Magmar',            'MAGMAR',       3),
+        Pokemon( 127,  'Pinsir',            'PINSIR',       2),
+        Pokemon( 128,  'Tauros',            'TAUROS',       3),
+        Pokemon( 129,  'Magikarp',          'MAGIKARP',     2),
+        Pokemon( 130,  'Gyarados',          'GYARADOS',     5),
+        Pokemon( 131,  'Lapras',            'LAPRAS',       4),
+        Pokemon( 132,  'Ditto',             'DITTO',        5),
+        Pokemon( 133,  'Eevee',             'EEVEE',        2),
+        Pokemon( 134,  'Vaporeon',          'VAPOREON',     4),
+        Pokemon( 135,  'Jolteon',           'JOLTEON',      4),
+        Pokemon( 136,  'Flareon',           'FLAREON',      5),
+        Pokemon( 137,  'Porygon',           'PORYGON',      4),
+        Pokemon( 138,  'Omanyte',           'OMANYTE',      3),
+        Pokemon( 139,  'Omastar',           'OMASTAR',      5),
+        Pokemon( 140,  'Kabuto',            'KABUTO',       3),
+        Pokemon( 141,  'Kabutops',          'KABUTOPS',     5),
+        Pokemon( 142,  'Aerodactyl',        'AERODACTYL',   4),
+        Pokemon( 143,  'Snorlax',           'SNORLAX',      3),
+        Pokemon( 144,  'Articuno',          'ARTICUNO',     5),
+        Pokemon( 145,  'Zapdos',            'ZAPDOS',       5),
+        Pokemon( 146,  'Moltres',           'MOLTRES',      5),
+        Pokemon( 147,  'Dratini',           'DRATINI',      3),
+        Pokemon( 148,  'Dragonair',         'DRAGONAIR',    4),
+        Pokemon( 149,  'Dragonite',         'DRAGONITE',    4),
+        Pokemon( 150,  'Mewtwo',            'MEWTWO',       5),
+        Pokemon( 151,  'Mew',               'MEW',          5),
+    ])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,55 @@
+'''Geofence of the spawns: the location groups are the named areas, each one its
+locations widened by a radius. Spawns outside the areas that matter can be
+dropped before matching, or at ingest.'''
+from pokedb import Location
+from pokematch import AreaIndex
+import threading
+import logging
+import time
+
+logger = logging.getLogger('poke.geofence')
+
+
+class Geofence(object):
+    '''The AreaIndex of the locations, reloaded when they change. The locations are
+    looked at no more than once every check_every seconds.'''
+
+    def __init__(self, radius=2000.0, check_every=60.0, cell_size=0.01):
+        self.radius = radius
+        self.check_every = check_every
+        self.cell_size = cell_size
+        self.index = AreaIndex(radius=radius, cell_size=cell_size)
+        self.fingerprint = None
+        self.checked = None
+        self.reloads = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config.get('geofence', {})
+        return cls(radius=conf.get('radius', 2000.0), check_every=conf.get('check-every', 60.0))
+
+    def refresh(self, now=None):
+        '''Reloads the areas if the locations changed, returns whether it did'''
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.checked is not None and now - self.checked < self.check_every:
+                return False
+            self.checked = now
+            fingerprint = Location.fingerprint()
+            if fingerprint == self.fingerprint:
+                return False
+            self.index = AreaIndex(Location.areas(), self.radius, self.cell_size)
+            self.fingerprint = fingerprint
+            self.reloads += 1
+        logger.info("Loaded {} areas, {} cells".format(len(self.index), len(self.index.cells)))
+        return True
+
+    def covers(self, latitude, longitude):
+        '''Whether the point is in some area; everywhere is when there are none'''
+        index = self.index
+        return not len(index) or bool(index.at(latitude, longitude))
+
+    def metrics(self):
+        index = self.index
+        return { 'areas': len(index), 'cells': len(index.cells), 'reloads': self.reloads }
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''HTTP ingest for scanned spawns, replacing poke.php.
+
+POST a JSON array of spawns, a single spawn object or NDJSON (one spawn per
+line) and the whole batch is written with multi-row inserts and one commit.
+The old GET form (?encounter_id=...&expiration_timestamp=...&...) still works.
+Requests are served by a fixed pool of threads, taking connections from the
+DB pool.'''
+from pokedb import *
+from pokegeofence import Geofence
+import http.server
+import concurrent.futures
+import urllib.parse
+import logging
+import json
+
+logger = logging.getLogger('poke.ingest')
+
+FIELDS = {
+    'encounter_id': str,
+    'expiration_timestamp': lambda v: int(float(v)),
+    'latitude': float,
+    'longitude': float,
+    'name': str,
+    'spawn_point_id': str,
+}
+
+
+def parse_spawn(obj):
+    '''Spawn dict with the FIELDS converted to their types, raises ValueError'''
+    try:
+        return { k: conv(obj[k]) for k, conv in FIELDS.items() }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("invalid spawn {} - {}".format(obj, e))
+
+
+def parse_body(body):
+    '''Spawns in a JSON array, a JSON object or NDJSON'''
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+    try:
+        # a whole document, even pretty-printed
+        objs = json.loads(text)
+    except ValueError:
+        if '\n' not in text:
+            raise
+        objs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not isinstance(objs, list):
+        objs = [objs]
+    return [parse_spawn(o) for o in objs]
+
+
+class IngestHandler(http.server.BaseHTTPRequestHandler):
+    def reply(self, code, result):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Access-Control-Allow-Origin', 'https://fastpokemap.se')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def store(self, spawns):
+        if len(spawns) > self.server.max_batch:
+            return self.reply(413, {'error': 'batch larger than {}'.format(self.server.max_batch)})
+        dropped = 0
+        geofence = self.server.geofence
+        if geofence is not None:
+            try:
+                geofence.refresh()
+            except Exception as e:
+                # keep the areas loaded last
+                logger.warning("Error reloading the areas - {}".format(e))
+            kept = [s for s in spawns if geofence.covers(s['latitude'], s['longitude'])]
+            dropped = len(spawns) - len(kept)
+            spawns = kept
+        try:
+            count = Spawn.register_many(spawns) if spawns else 0
+        except Exception as e:
+            return self.reply(500, {'error': str(e)})
+        self.reply(200, {'result': [], 'count': count, 'dropped': dropped})
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            spawn = parse_spawn({ k: v[0] for k, v in query.items() })
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        self.store([spawn])
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            spawns = parse_body(self.rfile.read(length))
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        self.store(spawns)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    '''Serves each request on a fixed pool of threads, giving the DB connection
+    back to the pool after each one'''
+    def __init__(self, address, handler, workers=4, max_batch=5000, geofence=None):
+        http.server.HTTPServer.__init__(self, address, handler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.max_batch = max_batch
+        # spawns outside every area are not stored
+        self.geofence = geofence
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            DB.release()
+
+    def server_close(self):
+        http.server.HTTPServer.server_close(self)
+        self.pool.shutdown(wait=True)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    config = DB.config()
+    conf = config.get('ingest', {})
+    geofence = None
+    if config.get('geofence', {}).get('ingest', False):
+        geofence = Geofence.from_config(config)
+    server = PooledHTTPServer((conf.get('host', '127.0.0.1'), conf.get('port', 8080)),
+            IngestHandler, workers=conf.get('workers', 4), max_batch=conf.get('max-batch', 5000),
+            geofence=geofence)
+    logger.info("Ingest listening on {}:{}".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
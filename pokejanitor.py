@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''Deletes expired spawns, their notifications and old position history.
+
+Rows go in small chunks, each in its own transaction with a pause in between,
+so the periodic check is never kept waiting on a lock. A run stops after
+max_chunks chunks of each kind and the next one goes on from there. Runs on its
+own scheduler thread in the bot, or with `python pokejanitor.py`, which clears
+the whole backlog.'''
+from pokedb import *
+import logging
+import time
+
+logger = logging.getLogger('poke.telegram.janitor')
+
+
+class Janitor(object):
+    def __init__(self, spawn_retention=3600, chunk=1000, pause=0.05, max_chunks=None):
+        self.spawn_retention = spawn_retention
+        self.chunk = chunk
+        self.pause = pause
+        self.max_chunks = max_chunks # None runs until there is nothing left
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config.get('janitor', {})
+        return cls(spawn_retention=conf.get('spawn-retention-minutes', 60) * 60,
+                chunk=conf.get('chunk-size', 1000), pause=conf.get('pause', 0.05),
+                max_chunks=conf.get('max-chunks', 100))
+
+    def more(self, removed, chunks):
+        '''Whether to go on after chunks full chunks'''
+        if removed < self.chunk:
+            return False
+        if self.max_chunks is not None and chunks >= self.max_chunks:
+            logger.info("Janitor stopped after {} chunks, the rest goes next run".format(chunks))
+            return False
+        return True
+
+    def run(self):
+        '''Returns {"spawns": n, "notifications": n, "positions": n, "seconds": t}'''
+        start = time.time()
+        removed = { 'spawns': 0, 'notifications': 0, 'positions': 0 }
+
+        before = int(start - self.spawn_retention)
+        chunks = 0
+        while True:
+            spawns, notifications = Spawn.purge(before, self.chunk)
+            removed['spawns'] += spawns
+            removed['notifications'] += notifications
+            chunks += 1
+            if not self.more(spawns, chunks):
+                break
+            time.sleep(self.pause)
+
+        chunks = 0
+        while True:
+            positions = UserPosition.prune(chunk=self.chunk)
+            removed['positions'] += positions
+            chunks += 1
+            if not self.more(positions, chunks):
+                break
+            time.sleep(self.pause)
+
+        removed['seconds'] = time.time() - start
+        logger.info("Janitor removed {spawns} spawns, {notifications} notifications and "
+                "{positions} positions in {seconds:.2f}s".format(**removed))
+        return removed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    janitor = Janitor.from_config(DB.config())
+    janitor.max_chunks = None
+    janitor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+import math
+import collections
+import heapq
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+R = 6371000.0 #raio da terra em metros
+
+# below this many points the numpy call costs more than the plain loop
+VECTOR_MIN = 32
+
+
+def distance(pA, pB):
+    aLat = math.radians(pA.latitude)
+    aLng = math.radians(pA.longitude)
+    bLat = math.radians(pB.latitude)
+    bLng = math.radians(pB.longitude)
+    distLat = bLat - aLat
+    distLng = (bLng - aLng) * math.cos(0.5*(bLat+aLat))
+
+    dist = R * math.sqrt(distLat*distLat + distLng*distLng)
+    return dist
+
+
+def distances(pos, latitudes, longitudes):
+    '''Distances from pos to each of the points, with the same formula as distance().
+    Uses numpy when it is installed and there are enough points.'''
+    if numpy is None or len(latitudes) < VECTOR_MIN:
+        aLat = math.radians(pos.latitude)
+        aLng = math.radians(pos.longitude)
+        result = []
+        for lat, lng in zip(latitudes, longitudes):
+            bLat = math.radians(lat)
+            distLat = bLat - aLat
+            distLng = (math.radians(lng) - aLng) * math.cos(0.5*(bLat+aLat))
+            result.append(R * math.sqrt(distLat*distLat + distLng*distLng))
+        return result
+
+    aLat = math.radians(pos.latitude)
+    aLng = math.radians(pos.longitude)
+    bLat = numpy.radians(numpy.asarray(latitudes, dtype=numpy.float64))
+    bLng = numpy.radians(numpy.asarray(longitudes, dtype=numpy.float64))
+    distLat = bLat - aLat
+    distLng = (bLng - aLng) * numpy.cos(0.5*(bLat+aLat))
+    return R * numpy.sqrt(distLat*distLat + distLng*distLng)
+
+
+def distance_matrix(positions, latitudes, longitudes):
+    '''[user][point] distances from each of positions to each of the points'''
+    if numpy is None:
+        return [distances(pos, latitudes, longitudes) for pos in positions]
+
+    aLat = numpy.radians(numpy.array([p.latitude for p in positions], dtype=numpy.float64))[:, None]
+    aLng = numpy.radians(numpy.array([p.longitude for p in positions], dtype=numpy.float64))[:, None]
+    bLat = numpy.radians(numpy.asarray(latitudes, dtype=numpy.float64))[None, :]
+    bLng = numpy.radians(numpy.asarray(longitudes, dtype=numpy.float64))[None, :]
+    distLat = bLat - aLat
+    distLng = (bLng - aLng) * numpy.cos(0.5*(bLat+aLat))
+    return R * numpy.sqrt(distLat*distLat + distLng*distLng)
+
+
+def span(latitude, radius):
+    '''(degrees of latitude, degrees of longitude) of a box around a point at
+    latitude holding everything closer than radius'''
+    # the equirectangular distance uses the cosine of the mean latitude, so the
+    # longitude span is taken at the box edge closer to a pole
+    span_lat = math.degrees(radius / R) * (1.0 + 1e-9)
+    edge_lat = min(abs(latitude) + span_lat, 90.0)
+    cos_lat = math.cos(math.radians(edge_lat))
+    span_lng = span_lat / cos_lat if cos_lat > 1e-9 else 360.0
+    return span_lat, span_lng
+
+
+class SpawnGrid(object):
+    '''Buckets spawns into fixed-size lat/lng cells so a user only has to look
+    at the cells that can be within their distance, instead of every spawn.'''
+
+    def __init__(self, spawns=(), cell_size=0.01):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+        self.count = 0
+        self.seq = 0
+        self.scanned = 0 # distances computed by near()
+        for s in spawns:
+            self.add(s)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for bucket in self.cells.values():
+            for seq, s in bucket:
+                yield s
+
+    def cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_size)),
+                int(math.floor(longitude / self.cell_size)))
+
+    def add(self, spawn):
+        # the sequence number keeps results in the same order the spawns were added
+        self.cells[self.cell(spawn.latitude, spawn.longitude)].append((self.seq, spawn))
+        self.seq += 1
+        self.count += 1
+
+    def remove(self, spawn):
+        key = self.cell(spawn.latitude, spawn.longitude)
+        old = self.cells.get(key, ())
+        bucket = [e for e in old if e[1] is not spawn]
+        self.count -= len(old) - len(bucket)
+        if bucket:
+            self.cells[key] = bucket
+        else:
+            self.cells.pop(key, None)
+
+    def near(self, pos, radius):
+        '''Returns [(spawn, dist)] for spawns closer than radius to pos, in insertion order'''
+        span_lat, span_lng = span(pos.latitude, radius)
+        lat0, lng0 = self.cell(pos.latitude - span_lat, pos.longitude - span_lng)
+        lat1, lng1 = self.cell(pos.latitude + span_lat, pos.longitude + span_lng)
+
+        if (lat1 - lat0 + 1) * (lng1 - lng0 + 1) > len(self.cells):
+            buckets = [b for (i, j), b in self.cells.items()
+                    if lat0 <= i <= lat1 and lng0 <= j <= lng1]
+        else:
+            buckets = [self.cells[k] for k in
+                    ((i, j) for i in range(lat0, lat1 + 1) for j in range(lng0, lng1 + 1))
+                    if k in self.cells]
+
+        candidates = [e for bucket in buckets for e in bucket]
+        self.scanned += len(candidates)
+        dists = distances(pos, [s.latitude for seq, s in candidates],
+                [s.longitude for seq, s in candidates])
+        found = [(seq, s, float(dist)) for (seq, s), dist in zip(candidates, dists) if dist < radius]
+        found.sort(key=lambda f: f[0])
+        return [(s, dist) for seq, s, dist in found]
+
+
+class AreaIndex(object):
+    '''Named areas, each the locations of a group widened by radius meters, compiled
+    to the grid cells they touch, so the areas of a point are one dict lookup away.
+    Cells are whole, so an area reaches a bit past radius, never short of it.'''
+
+    def __init__(self, areas=None, radius=2000.0, cell_size=0.01):
+        self.cell_size = cell_size
+        self.radius = radius
+        self.cells = {} # cell -> frozenset of area ids
+        self.count = 0
+        cells = collections.defaultdict(set)
+        for area, points in (areas or {}).items():
+            self.count += 1
+            for latitude, longitude in points:
+                span_lat, span_lng = span(latitude, radius)
+                lat0, lng0 = self.cell(latitude - span_lat, longitude - span_lng)
+                lat1, lng1 = self.cell(latitude + span_lat, longitude + span_lng)
+                for i in range(lat0, lat1 + 1):
+                    for j in range(lng0, lng1 + 1):
+                        cells[(i, j)].add(area)
+        for key, ids in cells.items():
+            self.cells[key] = frozenset(ids)
+
+    def __len__(self):
+        return self.count
+
+    def cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_size)),
+                int(math.floor(longitude / self.cell_size)))
+
+    def at(self, latitude, longitude):
+        '''Ids of the areas covering the point'''
+        return self.cells.get(self.cell(latitude, longitude), frozenset())
+
+    def covering(self, positions):
+        '''Ids of the areas covering any of positions'''
+        found = set()
+        for pos in positions:
+            found.update(self.at(pos.latitude, pos.longitude))
+        return found
+
+
+class SpeciesIndex(object):
+    '''Maps each pokemon internal_name to the users subscribed to it, built once per
+    tick, so spawns of species nobody follows can be dropped before matching.'''
+
+    def __init__(self):
+        self.species = collections.defaultdict(dict) # internal_name -> {user_id: user}
+        self.users = {} # user_id -> {internal_name: filter}
+
+    def __contains__(self, name):
+        return name in self.species
+
+    def add(self, user, filters):
+        wanted = {}
+        for f in filters:
+            if f.internal_name is not None:
+                wanted.setdefault(f.internal_name, f)
+        self.users[user.id] = wanted
+        for name in wanted:
+            self.species[name][user.id] = user
+        return wanted
+
+    def remove(self, user_id):
+        for name in self.users.pop(user_id, {}):
+            del self.species[name][user_id]
+            if not self.species[name]:
+                del self.species[name]
+
+    def subscribers(self, name):
+        return self.species.get(name, {})
+
+    def filters(self, user_id):
+        return self.users.get(user_id, {})
+
+
+class Matcher(object):
+    '''Keeps the active spawns between ticks. Each tick only the spawns inserted
+    since the last one are fetched; users whose position, distance or filters did
+    not change are only matched against those, everyone else against all of them.'''
+
+    # how many ids before the cursor are fetched again, in case an insert with a
+    # lower id was committed after a later one; at least an ingest batch, whose
+    # ids are taken when it starts and seen when it commits. Inserts later than
+    # that are picked up by the full read every full_read_interval seconds.
+    lookback = 5000
+    full_read_interval = 60.0
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self.reset()
+
+    def reset(self):
+        self.active = {} # encounter_id -> spawn
+        self.expiry = [] # heap of (expiration_timestamp, encounter_id) of the active spawns
+        self.held = collections.defaultdict(dict) # species out of the grid: name -> {encounter_id: spawn}
+        self.indexed = set() # species in the grid
+        self.grid = SpawnGrid(cell_size=self.cell_size)
+        self.cursor = 0 # highest spawn id fetched
+        self.full = False # next fetch reads every active spawn
+        self.full_read = 0.0 # when the last one did
+        self.pairs = 0
+        self.reset_users()
+
+    def reset_users(self):
+        '''Makes every user be matched against all the active spawns on the next tick'''
+        self.seen = {} # user_id -> (latitude, longitude, distance, species)
+
+    def next_id(self, now=None):
+        '''Id the next fetch starts after, 0 when it is time for a full read'''
+        now = time.time() if now is None else now
+        if now - self.full_read >= self.full_read_interval:
+            self.full = True
+        if self.full:
+            return 0
+        return max(0, self.cursor - self.lookback)
+
+    def rewind(self):
+        '''Makes the next fetch read every active spawn again, to pick up the ones
+        committed late or turned down by update() before; those it already has are
+        skipped'''
+        self.full = True
+
+    def update(self, spawns, species, now, accept=None):
+        '''Adds the new spawns accept() takes, drops the expired ones and returns a
+        SpawnGrid of the new spawns of subscribed species'''
+        if self.full:
+            self.full_read = now
+            self.full = False
+        while self.expiry and self.expiry[0][0] <= now:
+            exp, eid = heapq.heappop(self.expiry)
+            if eid in self.active:
+                self.discard(self.active[eid])
+
+        for name in species.species:
+            if name not in self.indexed:
+                self.indexed.add(name)
+                for s in self.held.pop(name, {}).values():
+                    self.grid.add(s)
+
+        new = SpawnGrid(cell_size=self.cell_size)
+        for s in spawns:
+            self.cursor = max(self.cursor, s.id)
+            if s.encounter_id in self.active or s.expiration_timestamp <= now:
+                continue
+            if accept is not None and not accept(s):
+                continue
+            self.active[s.encounter_id] = s
+            heapq.heappush(self.expiry, (s.expiration_timestamp, s.encounter_id))
+            if s.name in self.indexed:
+                self.grid.add(s)
+                new.add(s)
+            else:
+                self.held[s.name][s.encounter_id] = s
+        return new
+
+    def discard(self, spawn):
+        del self.active[spawn.encounter_id]
+        if spawn.name in self.indexed:
+            self.grid.remove(spawn)
+        else:
+            self.held[spawn.name].pop(spawn.encounter_id, None)
+            if not self.held[spawn.name]:
+                del self.held[spawn.name]
+
+    def match(self, users, species, new, partial=False):
+        '''Returns [(user, spawn, filter, dist)] for the spawns each user wants within
+        their distance. users is everybody, unless partial is set, which keeps what
+        was seen of the users left out.'''
+        found = []
+        seen = {}
+        scanned = self.grid.scanned + new.scanned
+        for u in users:
+            wanted = species.filters(u.id)
+            pos = u.position()
+            seen[u.id] = (pos.latitude, pos.longitude, u.distance, frozenset(wanted))
+            grid = new if self.seen.get(u.id) == seen[u.id] else self.grid
+            for s, dist in grid.near(pos, u.distance):
+                f = wanted.get(s.name)
+                if f is not None:
+                    found.append((u, s, f, dist))
+        # (user, spawn) distances computed
+        self.pairs = self.grid.scanned + new.scanned - scanned
+        if partial:
+            self.seen.update(seen)
+        else:
+            self.seen = seen
+        return found
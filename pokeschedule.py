@@ -0,0 +1,110 @@
+import threading
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('poke.telegram.schedule')
+
+
+class TickScheduler(object):
+    '''Runs fn on its own thread, one call at a time. The next tick is due interval
+    seconds after the last one started; when a tick ends past that, the missed
+    ones are skipped and the next one runs right away. With adaptive set the
+    interval follows the tick duration, so that ticks take about `load` of the
+    time, between min_interval and max_interval.'''
+
+    def __init__(self, fn, name='periodic', interval=30.0, min_interval=10.0,
+            max_interval=120.0, load=0.5, adaptive=True, stats=None):
+        self.fn = fn
+        self.name = name
+        self.interval = float(interval)
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.load = load
+        self.adaptive = adaptive
+        self.stats = stats
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counters = { 'ticks': 0, 'skipped': 0, 'overruns': 0, 'errors': 0,
+                'last_lag': 0.0, 'max_lag': 0.0, 'last_duration': 0.0 }
+
+    def start(self, delay=0.0):
+        self.thread = threading.Thread(target=self._run, args=(delay,), name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def metrics(self):
+        with self.lock:
+            m = dict(self.counters)
+            m['interval'] = self.interval
+        return m
+
+    def _run(self, delay):
+        due = run_at = time.time() + delay
+        while not self.stopping.wait(max(run_at - time.time(), 0.0)):
+            start = time.time()
+            try:
+                self.fn()
+            except Exception as e:
+                logger.error("{} tick failed - {}".format(self.name, e))
+                with self.lock:
+                    self.counters['errors'] += 1
+            due, run_at = self._done(due, start, time.time())
+
+    async def run_async(self, call, delay=0.0):
+        '''The same schedule as a coroutine, for the asyncio runtime: call() returns
+        the awaitable of a tick'''
+        due = run_at = time.time() + delay
+        while not self.stopping.is_set():
+            await asyncio.sleep(max(run_at - time.time(), 0.0))
+            if self.stopping.is_set():
+                break
+            start = time.time()
+            try:
+                await call()
+            except Exception as e:
+                logger.error("{} tick failed - {}".format(self.name, e))
+                with self.lock:
+                    self.counters['errors'] += 1
+            due, run_at = self._done(due, start, time.time())
+
+    def _done(self, due, start, end):
+        '''Records a tick that was due at due and ran from start to end. Returns when
+        the next one is due and when it runs, which is later if this one ran late.
+        Overruns are counted here and logged by Stats, with the stages.'''
+        duration = end - start
+        with self.lock:
+            interval = self.interval
+            c = self.counters
+            c['ticks'] += 1
+            c['last_lag'] = start - due
+            c['max_lag'] = max(c['max_lag'], c['last_lag'])
+            c['last_duration'] = duration
+            if duration > interval:
+                c['overruns'] += 1
+            if self.adaptive:
+                wanted = min(self.max_interval, max(self.min_interval, duration / self.load))
+                # grow at once under load, shrink slowly when there is room
+                self.interval = wanted if wanted > interval else 0.8 * interval + 0.2 * wanted
+
+            due = run_at = start + self.interval
+            missed = 0
+            if end > due:
+                # missed ticks are merged into the one that runs now
+                missed = int((end - due) // self.interval)
+                c['skipped'] += missed
+                run_at = end
+        if missed:
+            logger.warning("{} tick took {:.1f}s, skipped {} ticks, interval now {:.1f}s".format(
+                self.name, duration, missed, self.interval))
+        if self.stats is not None:
+            self.stats.set_interval(self.name, self.interval)
+        return due, run_at
@@ -0,0 +1,176 @@
+import threading
+import queue
+import logging
+import collections
+import time
+
+logger = logging.getLogger('poke.telegram.sender')
+
+
+class TokenBucket(object):
+    '''Allows `rate` operations per second with bursts of up to `burst`'''
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, now):
+        '''Seconds until a token is available, 0 if there is one now'''
+        self.refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1.0
+
+
+class Message(object):
+    def __init__(self, method, chat_id, args, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class Sender(object):
+    '''Sends bot messages from a pool of worker threads, so a slow Telegram answer
+    only holds the chats of one worker. Chats are spread over the workers by hash,
+    which keeps the messages of each chat in order, and every send takes a token
+    from the chat bucket and from the global one. Failed sends are retried with
+    exponential backoff, honoring the retry_after Telegram sends when flooded.'''
+
+    def __init__(self, bot, workers=4, global_rate=30, chat_rate=1, chat_burst=3,
+            retries=3, backoff=1.0):
+        self.bot = bot
+        self.retries = retries
+        self.backoff = backoff
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.global_lock = threading.Lock()
+        self.inboxes = [queue.Queue() for i in range(workers)]
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for i, inbox in enumerate(self.inboxes):
+            t = threading.Thread(target=self._run, args=(inbox,), name='sender-{}'.format(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        '''Stops the workers after the messages already queued are sent'''
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+        self.running = False
+
+    def sendVenue(self, chat_id, *args, **kwargs):
+        self.put(Message('sendVenue', chat_id, args, kwargs))
+
+    def sendMessage(self, chat_id, *args, **kwargs):
+        self.put(Message('sendMessage', chat_id, args, kwargs))
+
+    def put(self, msg):
+        with self.stats_lock:
+            self.stats['queued'] += 1
+            self.stats['max_queued'] = max(self.stats['max_queued'], self.stats['queued'])
+        self.inboxes[hash(msg.chat_id) % len(self.inboxes)].put(msg)
+
+    def metrics(self):
+        with self.stats_lock:
+            m = dict(self.stats)
+        for k in ('queued', 'max_queued', 'sent', 'retried', 'failed'):
+            m.setdefault(k, 0)
+        m['inbox'] = [inbox.qsize() for inbox in self.inboxes]
+        return m
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _take_global(self):
+        with self.global_lock:
+            while True:
+                wait = self.global_bucket.delay(time.time())
+                if wait <= 0:
+                    self.global_bucket.consume()
+                    return
+                time.sleep(wait)
+
+    def _run(self, inbox):
+        pending = collections.OrderedDict() # chat_id -> deque of messages, in arrival order
+        buckets = {}
+        stopping = False
+        while not stopping or pending:
+            # wait for new messages until the first pending chat can send again
+            timeout = None
+            if pending:
+                now = time.time()
+                timeout = min(max(buckets[c].delay(now), q[0].not_before - now)
+                        for c, q in pending.items())
+            try:
+                msg = inbox.get(timeout=max(timeout, 0.0) if timeout is not None else None)
+                while True:
+                    if msg is None:
+                        stopping = True
+                    else:
+                        pending.setdefault(msg.chat_id, collections.deque()).append(msg)
+                        if msg.chat_id not in buckets:
+                            buckets[msg.chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                    msg = inbox.get_nowait()
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            for chat_id in list(pending.keys()):
+                q = pending[chat_id]
+                if buckets[chat_id].delay(now) > 0 or q[0].not_before > now:
+                    continue
+                msg = q.popleft()
+                if not q:
+                    del pending[chat_id]
+                buckets[chat_id].consume()
+                self._take_global()
+                self._send(msg, pending)
+                now = time.time()
+
+            for chat_id in [c for c in buckets if c not in pending and buckets[c].delay(now) == 0
+                    and buckets[c].tokens >= buckets[c].burst]:
+                del buckets[chat_id]
+
+    def _send(self, msg, pending):
+        try:
+            getattr(self.bot, msg.method)(msg.chat_id, *msg.args, **msg.kwargs)
+            self._count('sent')
+            self._count('queued', -1)
+        except Exception as e:
+            msg.attempts += 1
+            if msg.attempts > self.retries:
+                logger.error("Giving up {} to {} after {} attempts - {}".format(
+                    msg.method, msg.chat_id, msg.attempts, e))
+                self._count('failed')
+                self._count('queued', -1)
+                return
+            wait = getattr(e, 'retry_after', None) or self.backoff * (2 ** (msg.attempts - 1))
+            logger.warning("Retrying {} to {} in {:.1f}s - {}".format(msg.method, msg.chat_id, wait, e))
+            msg.not_before = time.time() + wait
+            self._count('retried')
+            # back at the head, so the chat keeps its order
+            pending.setdefault(msg.chat_id, collections.deque()).appendleft(msg)
+            pending.move_to_end(msg.chat_id, last=False)
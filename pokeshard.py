@@ -0,0 +1,218 @@
+import multiprocessing
+import collections
+import logging
+import heapq
+import time
+from pokematch import Matcher, SpeciesIndex
+
+logger = logging.getLogger('poke.telegram.shard')
+
+
+class ShardUser(collections.namedtuple('ShardUser', ['id', 'latitude', 'longitude', 'distance'])):
+    '''What a shard needs of a user; it is its own position'''
+    __slots__ = ()
+
+    def position(self):
+        return self
+
+ShardFilter = collections.namedtuple('ShardFilter', ['internal_name'])
+
+
+def run_shard(conn, cell_size):
+    '''Shard process: keeps a Matcher with its own copy of the active spawns, and its
+    users between ticks, which are only sent again when they change'''
+    matcher = Matcher(cell_size)
+    species = SpeciesIndex()
+    users = {} # user_id -> ShardUser
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if msg[0] == 'reset_users':
+            matcher.reset_users()
+            continue
+
+        _, spawns, now, changed, removed, only = msg
+        for user_id in removed:
+            species.remove(user_id)
+            users.pop(user_id, None)
+        for user_id, latitude, longitude, distance, names in changed:
+            species.remove(user_id)
+            users[user_id] = ShardUser(user_id, latitude, longitude, distance)
+            species.add(users[user_id], [ShardFilter(n) for n in names])
+
+        new = matcher.update(spawns, species, now)
+        batch = users.values() if only is None else [users[i] for i in only]
+        found = matcher.match(batch, species, new, only is not None)
+        conn.send(([ (u.id, s.encounter_id, f.internal_name, dist) for u, s, f, dist in found ],
+            matcher.pairs))
+    conn.close()
+
+
+class ShardedMatcher(object):
+    '''Drop-in for Matcher that splits the users by id over worker processes, so
+    the matching of a tick can use more than one core. Every shard gets the new
+    spawns and indexes its own copy of the active ones, so only the work per user
+    is split, not the work per spawn, and the snapshot, record and send stages
+    stay in this process. How it scales with the number of shards has not been
+    measured on more than one core, so poke.json.example does not offer it yet.
+    This process only keeps the active spawns by id, and the caller still dedups
+    and sends the matches, through the NotificationLog, from here. A shard that
+    dies is started again and sent everything it had.'''
+
+    lookback = Matcher.lookback
+    full_read_interval = Matcher.full_read_interval
+
+    def __init__(self, shards, cell_size=0.01):
+        self.active = {} # encounter_id -> spawn, to turn the shard matches back into spawns
+        self.expiry = [] # heap of (expiration_timestamp, encounter_id) of the active spawns
+        self.cursor = 0 # highest spawn id fetched
+        self.full = False # next fetch reads every active spawn
+        self.full_read = 0.0 # when the last one did
+        self.pending = [] # new spawns not sent to the shards yet
+        self.sent = [{} for i in range(shards)] # user_id -> what the shard has of them
+        self.now = 0
+        self.pairs = 0
+        self.cell_size = cell_size
+        self.restarts = 0
+        self.pipes = [None] * shards
+        self.procs = [None] * shards
+        for i in range(shards):
+            self.start(i)
+
+    def start(self, i):
+        parent, child = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=run_shard, args=(child, self.cell_size),
+                name='shard-{}'.format(i))
+        p.daemon = True
+        p.start()
+        child.close()
+        self.pipes[i] = parent
+        self.procs[i] = p
+        self.sent[i] = {}
+
+    def restart(self, i):
+        logger.error("Shard {} died, starting it again".format(i))
+        self.restarts += 1
+        self.pipes[i].close()
+        if self.procs[i].is_alive():
+            self.procs[i].terminate()
+        self.procs[i].join(1.0)
+        self.start(i)
+
+    def stop(self, timeout=None):
+        for pipe in self.pipes:
+            try:
+                pipe.send(None)
+            except OSError:
+                pass
+        for p in self.procs:
+            p.join(timeout)
+        self.pipes = []
+        self.procs = []
+
+    def next_id(self, now=None):
+        now = time.time() if now is None else now
+        if now - self.full_read >= self.full_read_interval:
+            self.full = True
+        if self.full:
+            return 0
+        return max(0, self.cursor - self.lookback)
+
+    def reset_users(self):
+        for i, pipe in enumerate(self.pipes):
+            try:
+                pipe.send(('reset_users',))
+            except OSError:
+                # a new one has seen nobody yet
+                self.restart(i)
+
+    def rewind(self):
+        self.full = True
+
+    def update(self, spawns, species, now, accept=None):
+        '''Like Matcher.update, but returns a list of the new spawns; the shards get
+        them on the next match()'''
+        if self.full:
+            self.full_read = now
+            self.full = False
+        while self.expiry and self.expiry[0][0] <= now:
+            exp, eid = heapq.heappop(self.expiry)
+            self.active.pop(eid, None)
+
+        new = []
+        for s in spawns:
+            self.cursor = max(self.cursor, s.id)
+            if s.encounter_id in self.active or s.expiration_timestamp <= now:
+                continue
+            if accept is not None and not accept(s):
+                continue
+            self.active[s.encounter_id] = s
+            heapq.heappush(self.expiry, (s.expiration_timestamp, s.encounter_id))
+            new.append(s)
+        self.pending.extend(new)
+        self.now = now
+        return new
+
+    def message(self, i, users, species, spawns, partial):
+        '''What shard i needs for a match of its users: the spawns, the users that
+        changed since it last got them and, with a full list, those that are gone'''
+        changed = []
+        for u in users:
+            pos = u.position()
+            state = (pos.latitude, pos.longitude, u.distance, tuple(species.filters(u.id)))
+            if self.sent[i].get(u.id) != state:
+                self.sent[i][u.id] = state
+                changed.append((u.id,) + state)
+        removed = []
+        if not partial:
+            ids = set(u.id for u in users)
+            removed = [uid for uid in self.sent[i] if uid not in ids]
+            for uid in removed:
+                del self.sent[i][uid]
+        only = [u.id for u in users] if partial else None
+        return ('match', spawns, self.now, changed, removed, only)
+
+    def ask(self, i, users, species, spawns, partial):
+        '''Sends shard i its part of a match, False if it is dead'''
+        try:
+            self.pipes[i].send(self.message(i, users, species, spawns, partial))
+            return True
+        except OSError:
+            return False
+
+    def answer(self, i, asked, users, species, partial):
+        if asked:
+            try:
+                return self.pipes[i].recv()
+            except (OSError, EOFError):
+                pass
+        self.restart(i)
+        # the new one starts empty: every active spawn and all of its users
+        self.pipes[i].send(self.message(i, users, species, list(self.active.values()), partial))
+        return self.pipes[i].recv()
+
+    def match(self, users, species, new, partial=False):
+        shards = len(self.pipes)
+        by_shard = [[] for i in range(shards)]
+        by_id = {}
+        for u in users:
+            by_id[u.id] = u
+            by_shard[u.id % shards].append(u)
+
+        # every shard gets the spawns, even with no users, so their copies stay the same
+        spawns, self.pending = self.pending, []
+        asked = [self.ask(i, by_shard[i], species, spawns, partial) for i in range(shards)]
+
+        found = []
+        self.pairs = 0
+        for i in range(shards):
+            matches, pairs = self.answer(i, asked[i], by_shard[i], species, partial)
+            self.pairs += pairs
+            for user_id, encounter_id, name, dist in matches:
+                s = self.active.get(encounter_id)
+                if s is None:
+                    logger.warning("Shard matched unknown spawn {}".format(encounter_id))
+                    continue
+                found.append((by_id[user_id], s, species.filters(user_id)[name], dist))
+        return found
@@ -0,0 +1,241 @@
+'''Instrumentation of the notification jobs: time spent per stage, counters,
+the DB queries of each run, a Prometheus text endpoint, a periodic log line
+and cProfile dumps of the slowest runs.'''
+from pokedb import DB
+import threading
+import contextlib
+import collections
+import http.server
+import cProfile
+import heapq
+import logging
+import time
+import os
+
+logger = logging.getLogger('poke.telegram.stats')
+
+
+class Tick(object):
+    '''One run of a job'''
+    def __init__(self, job):
+        self.job = job
+        self.stages = collections.OrderedDict() # stage -> seconds
+        self.counters = collections.Counter()
+        self.elapsed = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+
+class JobStats(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.ticks = 0
+        self.overruns = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.last = None
+        self.stages = collections.Counter() # stage -> total seconds
+        self.counters = collections.Counter()
+        self.queries = 0
+        self.query_time = 0.0
+
+
+class Stats(object):
+    '''Collects the Ticks of each job. A tick longer than its job interval counts
+    as an overrun. With profile_dir set ticks run under cProfile, one at a time
+    as there can only be one profiler active, and the profiles of the
+    profile_keep slowest ones are kept there.'''
+
+    def __init__(self, profile_dir=None, profile_keep=5):
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict() # job -> JobStats
+        self.sources = collections.OrderedDict() # name -> fn returning a dict of numbers
+        self.profile_dir = profile_dir
+        self.profile_keep = profile_keep
+        self.profiles = [] # heap of (seconds, path)
+        self.profiling = threading.Lock() # held by the tick being profiled
+        self.profiled = 0 # makes the profile names unique
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config.get('stats', {})
+        profile_dir = conf.get('profile-dir', 'profiles') if conf.get('profile', False) else None
+        return cls(profile_dir=profile_dir, profile_keep=conf.get('profile-keep', 5))
+
+    def add_job(self, job, interval):
+        self.jobs[job] = JobStats(interval)
+
+    def set_interval(self, job, interval):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs[job].interval = interval
+
+    def add_source(self, name, fn):
+        '''Exports the numbers in the dict fn() returns as poke_<name>_<key> gauges'''
+        self.sources[name] = fn
+
+    @contextlib.contextmanager
+    def tick(self, job):
+        t = Tick(job)
+        queries, query_time = DB.thread_queries()
+        profiler = None
+        # ticks overlapping the one being profiled are not
+        if self.profile_dir and self.profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            yield t
+        finally:
+            if profiler:
+                profiler.disable()
+            t.elapsed = time.perf_counter() - start
+            queries_after, query_time_after = DB.thread_queries()
+            t.queries = queries_after - queries
+            t.query_time = query_time_after - query_time
+            self.record(t)
+            if profiler:
+                try:
+                    self.keep_profile(t, profiler)
+                finally:
+                    self.profiling.release()
+
+    def record(self, t):
+        with self.lock:
+            if t.job not in self.jobs:
+                self.jobs[t.job] = JobStats(None)
+            s = self.jobs[t.job]
+            s.ticks += 1
+            s.seconds += t.elapsed
+            s.max_seconds = max(s.max_seconds, t.elapsed)
+            s.last = t
+            s.stages.update(t.stages)
+            s.counters.update(t.counters)
+            s.queries += t.queries
+            s.query_time += t.query_time
+            overrun = s.interval is not None and t.elapsed > s.interval
+            if overrun:
+                s.overruns += 1
+        if overrun:
+            logger.warning("{} tick took {:.1f}s, longer than its {}s interval - {}".format(
+                t.job, t.elapsed, s.interval, self.describe(t)))
+
+    def keep_profile(self, t, profiler):
+        with self.lock:
+            if len(self.profiles) >= self.profile_keep and t.elapsed <= self.profiles[0][0]:
+                return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.profiled += 1
+        path = os.path.join(self.profile_dir, '{}-{}-{}-{:.3f}s.prof'.format(
+            t.job, time.strftime('%Y%m%d-%H%M%S'), self.profiled, t.elapsed))
+        profiler.dump_stats(path)
+        with self.lock:
+            heapq.heappush(self.profiles, (t.elapsed, path))
+            dropped = []
+            while len(self.profiles) > self.profile_keep:
+                dropped.append(heapq.heappop(self.profiles)[1])
+        for old in dropped:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def describe(self, t):
+        return "{:.3f}s queries={} ({:.3f}s) {} {}".format(t.elapsed, t.queries, t.query_time,
+            ' '.join('{}={:.3f}s'.format(k, v) for k, v in t.stages.items()),
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(t.counters.items())))
+
+    def log(self):
+        '''One line per job with the totals and its last tick'''
+        with self.lock:
+            lines = [ "{}: ticks={} overruns={} avg={:.3f}s max={:.3f}s last: {}".format(
+                job, s.ticks, s.overruns, s.seconds / max(s.ticks, 1), s.max_seconds,
+                self.describe(s.last) if s.last else '-')
+                for job, s in self.jobs.items() ]
+        for line in lines:
+            logger.info(line)
+
+    def render(self):
+        '''Prometheus text exposition of the stats'''
+        out = []
+        def metric(name, kind, samples):
+            out.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                labels = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+                out.append('{}{} {}'.format(name, '{' + labels + '}' if labels else '', value))
+
+        with self.lock:
+            jobs = list(self.jobs.items())
+            metric('poke_ticks_total', 'counter', [ ((('job', j),), s.ticks) for j, s in jobs ])
+            metric('poke_tick_overruns_total', 'counter',
+                    [ ((('job', j),), s.overruns) for j, s in jobs ])
+            metric('poke_tick_seconds_total', 'counter',
+                    [ ((('job', j),), s.seconds) for j, s in jobs ])
+            metric('poke_tick_max_seconds', 'gauge',
+                    [ ((('job', j),), s.max_seconds) for j, s in jobs ])
+            metric('poke_tick_last_seconds', 'gauge',
+                    [ ((('job', j),), s.last.elapsed) for j, s in jobs if s.last ])
+            metric('poke_stage_seconds_total', 'counter',
+                    [ ((('job', j), ('stage', k)), v) for j, s in jobs for k, v in s.stages.items() ])
+            metric('poke_stage_last_seconds', 'gauge',
+                    [ ((('job', j), ('stage', k)), v) for j, s in jobs if s.last
+                        for k, v in s.last.stages.items() ])
+            metric('poke_tick_items_total', 'counter',
+                    [ ((('job', j), ('item', k)), v) for j, s in jobs for k, v in s.counters.items() ])
+            metric('poke_db_queries_total', 'counter',
+                    [ ((('job', j),), s.queries) for j, s in jobs ])
+            metric('poke_db_query_seconds_total', 'counter',
+                    [ ((('job', j),), s.query_time) for j, s in jobs ])
+            sources = list(self.sources.items())
+
+        metric('poke_db_all_queries_total', 'counter', [ ((), DB.queries) ])
+        metric('poke_db_all_query_seconds_total', 'counter', [ ((), DB.query_time) ])
+        for name, fn in sources:
+            try:
+                values = fn()
+            except Exception as e:
+                logger.warning("Error reading {} stats - {}".format(name, e))
+                continue
+            for k, v in sorted(values.items()):
+                if isinstance(v, (int, float)):
+                    metric('poke_{}_{}'.format(name, k), 'gauge', [ ((), v) ])
+        return '\n'.join(out) + '\n'
+
+
+class StatsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.stats.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+def serve(stats, host='127.0.0.1', port=9102):
+    '''Serves /metrics from a daemon thread, returns the server'''
+    server = http.server.ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    server.stats = stats
+    t = threading.Thread(target=server.serve_forever, name='stats-http')
+    t.daemon = True
+    t.start()
+    return server
@@ -6,14 +6,38 @@ import logging
 import logging.handlers
 import sqlite3
 from pokedb import *
+from pokematch import *
+from pokesender import Sender
+from pokeshard import ShardedMatcher
+from pokestats import Stats, serve as serve_stats
+from pokeschedule import TickScheduler
+from pokeasync import AsyncDB, AsyncRuntime
+from pokejanitor import Janitor
+from pokegeofence import Geofence
 from datetime import *
-import math
-import json
+import time
+import functools
+import queue
+import threading
+import asyncio
 
 FFORMAT='%(levelname)1.1s|%(asctime)s| %(message)s'
 
 
 logger = logging.getLogger('poke.telegram')
+notification_log = NotificationLog()
+matcher = Matcher()
+sender = None
+stats = Stats()
+# users who sent a new position, for callback_events
+position_events = queue.Queue()
+# both matching jobs use the matcher and the users of the last sweep
+match_lock = threading.Lock()
+subscribed = {} # user_id -> user
+species = None
+# with the geofence on, only spawns in the areas of the subscribed users are matched
+geofence = None
+active_areas = frozenset()
 emoji = {
     "map": '\U0001f5fa',
     "keyboard": '\u2328',
@@ -39,18 +63,6 @@ def config_log(config):
 def get_user(update):
     return  User.find(update.message.chat_id)
 
-def distance(pA, pB):
-    R = 6371000.0 #raio da terra em metros
-    aLat = math.radians(pA.latitude)
-    aLng = math.radians(pA.longitude)
-    bLat = math.radians(pB.latitude)
-    bLng = math.radians(pB.longitude)
-    distLat = bLat - aLat
-    distLng = (bLng - aLng) * math.cos(0.5*(bLat+aLat))
-
-    dist = R * math.sqrt(distLat*distLat + distLng*distLng)
-    return dist
-
 def cmd_help(bot, update):
     chat_id = update.message.chat_id
     bot.sendMessage(chat_id,text=
@@ -76,8 +88,10 @@ def cmd_start(bot, update):
     else:
         msgfrom = update.message.from_user
         user = User.new(msgfrom.first_name, msgfrom.last_name, msgfrom.username, chat_id)
-        user.save()
-        update.message.reply_text("""I'm the PokeBot, I'll let you know when monsters are nearby.
+        if user is None:
+            bot.sendMessage(chat_id, text="Sorry, I could not sign you up. Please try /start again.")
+            return
+        bot.sendMessage(chat_id, text="""I'm the PokeBot, I'll let you know when monsters are nearby.
                 Please send your localization and a /distance""")
         logger.info('New User: {} {} (@{}-{})'.format(user.first_name, user.last_name, 
             user.username, chat_id))
@@ -144,6 +158,7 @@ def cmd_location(bot, update):
     try:
         loc = update.message.location
         user.update_position(loc.latitude, loc.longitude)
+        position_events.put(user)
         bot.sendMessage(chat_id, text='Position set' )
         logger.debug("{}({}) Position set: lat={}, lng={}".format(user.first_name, chat_id,
             loc.latitude, loc.longitude))
@@ -153,42 +168,159 @@ def cmd_location(bot, update):
             user.first_name, update.message, e ))
 
 
+def format_expiry(expiration_timestamp, now):
+    '''("MMmSSs", "MMmSSs left (HH:MM)") for a spawn expiring at expiration_timestamp'''
+    secs = expiration_timestamp - now
+    exp = datetime.fromtimestamp(expiration_timestamp)
+    short = "{:02d}m{:02d}s".format(int(secs/60), int(secs%60))
+    return short, "{} left ({:02d}:{:02d})".format(short, exp.hour, exp.minute)
+
+def notify(bot, matches, now, tick):
+    '''Sends the matches not notified yet'''
+    # the texts are shared by every user of a spawn
+    expiry = {}
+    for u, s, f, dist in matches:
+        if s.encounter_id not in expiry:
+            expiry[s.encounter_id] = format_expiry(s.expiration_timestamp, now)
+    tick.count('matches', len(matches))
+
+    with tick.stage('record'):
+        new = notification_log.record([ (s.encounter_id, u.id, s.expiration_timestamp)
+            for u, s, f, dist in matches ])
+    if new is None:
+        # nothing was sent, match everybody against everything again next time
+        matcher.reset_users()
+        return
+
+    out = sender if sender is not None else bot
+    notified = set()
+    with tick.stage('send'):
+        for u, s, f, dist in matches:
+            if (s.encounter_id, u.id) not in new:
+                continue
+            if u.id not in notified:
+                logger.debug( "{}({}) Notifying:".format(u.first_name, u.chat_id))
+                notified.add(u.id)
+
+            short, left = expiry[s.encounter_id]
+            logger.debug( "    spawn: {} dist: {:1.1f}m - exp in {}".format(f.name, dist, short))
+            out.sendVenue(u.chat_id, s.latitude, s.longitude, 
+                "{}".format(s.name),
+                "{} {:1.1f}m away".format(left, dist) )
+            tick.count('sent')
+
+def watch_areas(users, tick, grow=False):
+    '''Sets the areas with users, or adds those of users with grow. When an area
+    gains users, or the areas changed, the matcher is rewound to fetch the active
+    spawns it turned down before.'''
+    global active_areas
+    with tick.stage('areas'):
+        reloaded = geofence.refresh()
+        active = geofence.index.covering(u.position() for u in users)
+        if grow:
+            active |= active_areas
+        if reloaded or not active <= active_areas:
+            matcher.rewind()
+        active_areas = frozenset(active)
+    tick.count('areas', len(active_areas))
+
+def in_areas(tick):
+    '''accept() for matcher.update, None when there is no geofence'''
+    if geofence is None or not len(geofence.index):
+        return None
+    index, active = geofence.index, active_areas
+    # the lookback and full reads fetch spawns again, count each one once
+    counted = matcher.cursor
+    def accept(s):
+        if index.at(s.latitude, s.longitude).isdisjoint(active):
+            if s.id > counted:
+                tick.count('outside_areas')
+            return False
+        return True
+    return accept
+
+def fetch_spawns(now, tick):
+    with tick.stage('spawns'):
+        start = matcher.next_id(now)
+        if start == 0 and matcher.cursor:
+            tick.count('full_reads')
+        spawns = Spawn.since(start)
+        # expired spawns are dropped by update()
+        new_spawns = matcher.update(spawns, species, now, in_areas(tick))
+    tick.count('spawns', len(spawns))
+    tick.count('new_spawns', len(new_spawns))
+    return new_spawns
+
+def match(users, new_spawns, tick, partial=False):
+    with tick.stage('match'):
+        matches = matcher.match(users, species, new_spawns, partial)
+    tick.count('users', len(users))
+    tick.count('pairs', matcher.pairs)
+    return matches
+
 def callback_periodic_check(bot, job):
+    global species
     #print('.', end='', flush=True)
-    all_users = User.all()
-    all_spawns = list(Spawn.all_active())
-    now = datetime.now()
-    for u in all_users:
-        if not u.position():
-            continue
-        filters = list(u.filters()) #must convert to list, maps only iterate once
-
-        notified = False
-
-        for s in all_spawns:
-            exp = datetime.fromtimestamp(s.expiration_timestamp)
-            secs = (exp - now).total_seconds()
-            #print("  {:10s} - {:30s} - {:30s} - {}".format(s.name, str(now), str(exp), secs))
-            if secs < 0:
-                continue
-            for f in filters:
-                if s.name == f.internal_name:
-                    if u.notify(s.encounter_id):
-                        dist = distance(s, u.position())
-                        if dist < u.distance:
-                            if not notified:
-                                logger.debug( "{}({}) Notifying:".format(u.first_name, u.chat_id))
-                                notified = True
-
-                            logger.debug( "    spawn: {} dist: {:1.1f}m - exp in {:02d}m{:02d}s".format(
-                                f.name, dist, int(secs/60), int(secs%60)))
-                            bot.sendVenue(u.chat_id, s.latitude, s.longitude, 
-                                "{}".format(s.name),
-                                "{:02d}m{:02d}s left ({:02d}:{:02d}) {:1.1f}m away".format(
-                                    int(secs/60), int(secs%60), exp.hour, exp.minute, dist) )
-                    break
-        if not notified:
-            pass
+    # the lock first, waiting for the other job is not part of the tick
+    with match_lock, stats.tick('periodic') as tick:
+        with tick.stage('users'):
+            subscribed.clear()
+            species = SpeciesIndex()
+            for u in User.snapshot():
+                if not u.position() or u.distance is None:
+                    continue
+                if species.add(u, u.filters()):
+                    subscribed[u.id] = u
+        if geofence is not None:
+            watch_areas(subscribed.values(), tick)
+
+        now = time.time()
+        new_spawns = fetch_spawns(now, tick)
+        notify(bot, match(list(subscribed.values()), new_spawns, tick), now, tick)
+
+    if sender is not None:
+        logger.debug("Sender queue: {}".format(sender.metrics()))
+    logger.debug("User cache: {}".format(User.cache.metrics()))
+
+def callback_events(bot, job):
+    '''Matches right away the spawns inserted since the last check, against the users
+    subscribed to them, and the users that sent a new position, against all the
+    active spawns. Everybody else waits for callback_periodic_check.'''
+    updated = []
+    while True:
+        try:
+            updated.append(position_events.get_nowait())
+        except queue.Empty:
+            break
+
+    with match_lock, stats.tick('events') as tick:
+        if species is None:
+            return # before the first sweep
+        for u in updated:
+            if u.position() and u.distance is not None and species.add(u, u.filters()):
+                subscribed[u.id] = u
+            else:
+                subscribed.pop(u.id, None)
+        tick.count('positions', len(updated))
+        if geofence is not None:
+            watch_areas([u for u in updated if u.id in subscribed], tick, grow=True)
+
+        now = time.time()
+        new_spawns = fetch_spawns(now, tick)
+        users = {}
+        for s in new_spawns:
+            for uid in species.subscribers(s.name):
+                if uid in subscribed:
+                    users[uid] = subscribed[uid]
+        for u in updated:
+            if u.id in subscribed:
+                users[u.id] = subscribed[u.id]
+        if users:
+            # the updated users have a new position, so they are matched against every spawn
+            notify(bot, match(list(users.values()), new_spawns, tick, partial=True), now, tick)
+
+def callback_stats(bot, job):
+    stats.log()
 
 def cmd_text(bot, update):
     chat_id = update.message.chat_id
@@ -226,7 +358,17 @@ def cmd_keyboard(bot, update):
 
 
 def get_keyboard(user):
-    filters = [f.name for f in user.filters() ]
+    filters = set(f.name for f in user.filters())
+    # bit p.id is set for each enabled pokemon
+    enabled = 0
+    for p in Pokemon.all():
+        if p.name in filters:
+            enabled |= 1 << p.id
+    return build_keyboard(enabled, Pokemon.generation)
+
+@functools.lru_cache(maxsize=256)
+def build_keyboard(enabled, generation):
+    '''Keyboard for the enabled bitset; generation drops the layouts of an old catalogue'''
     r = emoji["ruler"]
     custom_keyboard = [ [ KeyboardButton(text=emoji["map"] + ' Location', request_location=True)],
         [r+'100m', r+'300m'], [r+'500m', r+'1000m'] ]
@@ -235,7 +377,7 @@ def get_keyboard(user):
     counter = 0
     row = []
     for p in pokes:
-        name = emoji["enabled"] if (p.name in filters) else emoji["disabled"]
+        name = emoji["enabled"] if (enabled >> p.id) & 1 else emoji["disabled"]
         name += ' ' + p.name
         row.append( name)
         if len(row) == 2:
@@ -250,10 +392,83 @@ def get_keyboard(user):
 def error(bot, update, error):
     logger.error('Update "{}" caused error"{}"'.format( update, error))
 
+def make_sender(bot, config):
+    sconf = config.get('sender', {})
+    return Sender(bot, workers=sconf.get('workers', 4),
+            global_rate=sconf.get('global-rate', 30), chat_rate=sconf.get('chat-rate', 1),
+            chat_burst=sconf.get('chat-burst', 3), retries=sconf.get('retries', 3),
+            backoff=sconf.get('backoff', 1.0)).start()
+
+def make_scheduler(config, fn=None):
+    '''The sweep scheduler, also recording its stats'''
+    schconf = config.get('scheduler', {})
+    scheduler = TickScheduler(fn,
+            interval=schconf.get('interval', 30.0), min_interval=schconf.get('min-interval', 10.0),
+            max_interval=schconf.get('max-interval', 120.0), load=schconf.get('load', 0.5),
+            adaptive=schconf.get('adaptive', True), stats=stats)
+    stats.add_job('periodic', scheduler.interval)
+    stats.add_source('scheduler', scheduler.metrics)
+    return scheduler
+
+def start_stats(config):
+    global stats
+    stats = Stats.from_config(config)
+    stats.add_source('sender', sender.metrics)
+    stats.add_source('user_cache', User.cache.metrics)
+    if geofence is not None:
+        stats.add_source('geofence', geofence.metrics)
+    stconf = config.get('stats', {})
+    if stconf.get('port'):
+        serve_stats(stats, stconf.get('host', '127.0.0.1'), stconf['port'])
+    return stconf.get('log-interval')
+
+def main_async(config):
+    '''Runs the bot on one asyncio loop, see pokeasync'''
+    global sender
+    bot = Bot(config['telegram-token'])
+    sender = make_sender(bot, config)
+    log_interval = start_stats(config)
+    aconf = config.get('async', {})
+    db = AsyncDB(aconf.get('db-workers', config['database'].get('pool-size', 8)))
+    runtime = AsyncRuntime(bot, db, handler_bot=sender, error=error,
+            poll_timeout=aconf.get('poll-timeout', 10))
+
+    runtime.command('help', cmd_help)
+    runtime.command('start', cmd_start)
+    runtime.command('add', cmd_add, pass_args=True)
+    runtime.command('rem', cmd_rem, pass_args=True)
+    runtime.command('distance', cmd_distance, pass_args=True)
+    runtime.command('list', cmd_list)
+    runtime.command('keyboard', cmd_keyboard)
+    runtime.on_text(cmd_text)
+    runtime.on_location(cmd_location)
+
+    runtime.every(make_scheduler(config), callback_periodic_check)
+    econf = config.get('events', {})
+    if econf.get('enabled', True):
+        interval = econf.get('interval', 2.0)
+        runtime.every(TickScheduler(None, 'events', interval, adaptive=False), callback_events,
+                delay=interval)
+        stats.add_job('events', interval)
+    if log_interval:
+        runtime.every(TickScheduler(None, 'stats', log_interval, adaptive=False), callback_stats,
+                delay=log_interval)
+    janitor = Janitor.from_config(config)
+    runtime.every(TickScheduler(None, 'janitor', config.get('janitor', {}).get('interval', 600.0),
+        adaptive=False), lambda bot, job: janitor.run(), delay=60.0)
+
+    logger.info("Starting PokeBot (asyncio).")
+    try:
+        asyncio.run(runtime.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+        sender.stop(timeout=10)
+
 def main():
-    config = {}
-    with open('poke.json') as config_file:
-        config = json.load(config_file)
+    global sender, matcher, geofence
+    config = load_config()
     config_log(config)
 
     if 'telegram-token' not in config:
@@ -261,32 +476,73 @@ def main():
         logger.error("Configuration file lacks Telegram Token")
         exit()
 
+    User.cache = UserCache.from_config(config)
+    if config.get('geofence', {}).get('enabled', False):
+        geofence = Geofence.from_config(config)
+    mconf = config.get('matcher', {})
+    shards = mconf.get('shards', 1)
+    if shards > 1:
+        # before the bot starts its threads
+        matcher = ShardedMatcher(shards)
+    # an ingest batch commits all its ids at once
+    matcher.lookback = mconf.get('lookback', config.get('ingest', {}).get('max-batch', 5000))
+    matcher.full_read_interval = mconf.get('full-read-interval', 60.0)
+
     try:
+        if config.get('runtime') == 'async':
+            main_async(config)
+            return
+
         updater = Updater(config['telegram-token'])
 
         dp = updater.dispatcher
 
         dp.add_handler(CommandHandler('help', cmd_help))
-        dp.add_handler(CommandHandler('start', cmd_start))
-        dp.add_handler(CommandHandler('add', cmd_add, pass_args=True))
-        dp.add_handler(CommandHandler('rem', cmd_rem, pass_args=True))
-        dp.add_handler(CommandHandler('distance', cmd_distance, pass_args=True))
-        dp.add_handler(CommandHandler('list', cmd_list))
-        dp.add_handler(CommandHandler('keyboard', cmd_keyboard ))
-        dp.add_handler(MessageHandler(Filters.text, cmd_text))
-        dp.add_handler(MessageHandler(Filters.location, cmd_location))
+        dp.add_handler(CommandHandler('start', releasing(cmd_start)))
+        dp.add_handler(CommandHandler('add', releasing(cmd_add), pass_args=True))
+        dp.add_handler(CommandHandler('rem', releasing(cmd_rem), pass_args=True))
+        dp.add_handler(CommandHandler('distance', releasing(cmd_distance), pass_args=True))
+        dp.add_handler(CommandHandler('list', releasing(cmd_list)))
+        dp.add_handler(CommandHandler('keyboard', releasing(cmd_keyboard) ))
+        dp.add_handler(MessageHandler(Filters.text, releasing(cmd_text)))
+        dp.add_handler(MessageHandler(Filters.location, releasing(cmd_location)))
+
+        sender = make_sender(updater.bot, config)
+        log_interval = start_stats(config)
+
+        # the sweep runs on its own thread, never overlapping itself
+        periodic_check = releasing(callback_periodic_check)
+        scheduler = make_scheduler(config, lambda: periodic_check(updater.bot, None))
 
         jq = updater.job_queue
-        jq.put(Job(callback_periodic_check, 30.0), next_t=0.0)
+        econf = config.get('events', {})
+        if econf.get('enabled', True):
+            interval = econf.get('interval', 2.0)
+            jq.put(Job(releasing(callback_events), interval), next_t=interval)
+            stats.add_job('events', interval)
+        if log_interval:
+            jq.put(Job(callback_stats, log_interval), next_t=log_interval)
+        janitor = Janitor.from_config(config)
+        # off the job queue, which also runs the events job
+        janitor_scheduler = TickScheduler(releasing(janitor.run), 'janitor',
+                config.get('janitor', {}).get('interval', 600.0), adaptive=False)
 
         dp.add_error_handler(error)
 
         logger.info("Starting PokeBot.")
         updater.start_polling()
+        scheduler.start()
+        janitor_scheduler.start(delay=60.0)
 
         updater.idle()
+        scheduler.stop(timeout=60)
+        janitor_scheduler.stop(timeout=60)
+        sender.stop(timeout=10)
     except Exception as e:
         logger.error("Error starting Bot: {}".format(e))
+    finally:
+        if shards > 1:
+            matcher.stop(timeout=10)
 
 
 if __name__ == '__main__':